@@ -1,12 +1,24 @@
 import os
 import json
+import time
 import asyncio
+import logging
 from dataclasses import dataclass
-from typing import Optional, List, Tuple, Dict, Any
+from typing import Optional, List, Tuple, Dict, Any, Iterator
+from urllib.parse import urlsplit
 
 import aiohttp
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from jose import jwt
+from jose.exceptions import JOSEError
+
+from app.utils.cache import TTLCache, SingleFlight
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.admission import Overloaded, get_limiter
+from app.utils.metrics import CallbackMetric, auth_request_seconds, register_cache, retries_total, stage
+
+logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------------------
 # Config
@@ -19,6 +31,42 @@ BYPASS_AUTH = os.getenv("BYPASS_AUTH", "false").lower() == "true"
 # Add your docker-compose service DNS here if you have it:
 DEFAULT_DOCKER_SERVICE = "http://user-management:7001"
 
+# Shared HTTP client pool (one per worker, created in the app lifespan)
+AUTH_HTTP_POOL_SIZE = int(os.getenv("AUTH_HTTP_POOL_SIZE", "100"))
+AUTH_HTTP_POOL_PER_HOST = int(os.getenv("AUTH_HTTP_POOL_PER_HOST", "20"))
+AUTH_HTTP_KEEPALIVE_SEC = float(os.getenv("AUTH_HTTP_KEEPALIVE_SEC", "30"))
+AUTH_HTTP_DNS_TTL_SEC = int(os.getenv("AUTH_HTTP_DNS_TTL_SEC", "300"))
+# A dead host should fail on connect quickly; a slow but alive one gets the read budget
+AUTH_HTTP_CONNECT_TIMEOUT_SEC = float(os.getenv("AUTH_HTTP_CONNECT_TIMEOUT_SEC", "1"))
+AUTH_HTTP_READ_TIMEOUT_SEC = float(os.getenv("AUTH_HTTP_READ_TIMEOUT_SEC", "5"))
+AUTH_HTTP_TOTAL_TIMEOUT_SEC = float(os.getenv("AUTH_HTTP_TOTAL_TIMEOUT_SEC", "10"))
+
+# Candidate endpoint health: circuit breaker + background prober
+AUTH_BREAKER_FAILURE_THRESHOLD = int(os.getenv("AUTH_BREAKER_FAILURE_THRESHOLD", "3"))
+AUTH_BREAKER_RESET_SEC = float(os.getenv("AUTH_BREAKER_RESET_SEC", "15"))
+AUTH_HEALTH_PROBE_INTERVAL_SEC = float(os.getenv("AUTH_HEALTH_PROBE_INTERVAL_SEC", "10"))
+# Any non-5xx answer (401 without a token included) counts as healthy
+AUTH_HEALTH_PROBE_PATH = os.getenv("AUTH_HEALTH_PROBE_PATH", "/users/info")
+
+# Token -> UserInfo / role-verification cache (keep the TTL below the revocation window)
+AUTH_CACHE_TTL_SEC = float(os.getenv("AUTH_CACHE_TTL_SEC", "60"))
+AUTH_CACHE_NEGATIVE_TTL_SEC = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL_SEC", "5"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+# Token verification: "remote" (auth service only) or "local" (JWT checked here,
+# auth service used only when the token cannot be decided locally)
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "remote").lower()
+AUTH_JWT_SECRET = os.getenv("AUTH_JWT_SECRET", "")
+AUTH_JWT_PUBLIC_KEY_FILE = os.getenv("AUTH_JWT_PUBLIC_KEY_FILE", "")
+AUTH_JWT_JWKS_FILE = os.getenv("AUTH_JWT_JWKS_FILE", "")
+AUTH_JWT_ALGORITHMS = [a.strip() for a in os.getenv("AUTH_JWT_ALGORITHMS", "HS256,RS256").split(",") if a.strip()]
+AUTH_JWT_AUDIENCE = os.getenv("AUTH_JWT_AUDIENCE", "")
+AUTH_JWT_ISSUER = os.getenv("AUTH_JWT_ISSUER", "")
+AUTH_JWT_USER_ID_CLAIM = os.getenv("AUTH_JWT_USER_ID_CLAIM", "sub")
+AUTH_JWT_ROLE_CLAIM = os.getenv("AUTH_JWT_ROLE_CLAIM", "role")
+# Minimum seconds between JWKS reloads triggered by an unknown key id
+AUTH_JWT_JWKS_RELOAD_SEC = float(os.getenv("AUTH_JWT_JWKS_RELOAD_SEC", "30"))
+
 # FastAPI security dependency
 security = HTTPBearer(auto_error=True)
 
@@ -33,11 +81,18 @@ class UserInfo:
     token: str
 
 
+@dataclass
+class _Rejection:
+    """Negative cache entry: the auth service rejected this token."""
+    status_code: int
+    detail: str
+
+
 # -----------------------------------------------------------------------------
 # URL candidates
 # -----------------------------------------------------------------------------
-def _candidate_urls(path: str) -> List[str]:
-    """Build a list of candidate base URLs with the given path appended."""
+def _configured_bases() -> List[str]:
+    """Candidate base URLs in configured priority order (deduplicated)."""
     bases = [
         AUTH_SERVICE_URL,
         AUTH_SERVICE_INTERNAL_URL,
@@ -46,7 +101,108 @@ def _candidate_urls(path: str) -> List[str]:
         "http://127.0.0.1:7001",             # Only works if service is on the same host namespace
         "http://localhost:7001",
     ]
-    return [f"{b}{path}" for b in bases if b]
+    return list(dict.fromkeys(b for b in bases if b))
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+# Last base URL that answered; tried first on the next call
+_preferred_base: Optional[str] = None
+
+
+def _breaker_for(base: str) -> CircuitBreaker:
+    breaker = _breakers.get(base)
+    if breaker is None:
+        breaker = CircuitBreaker(AUTH_BREAKER_FAILURE_THRESHOLD, AUTH_BREAKER_RESET_SEC)
+        _breakers[base] = breaker
+    return breaker
+
+
+def _candidate_bases() -> Iterator[str]:
+    """
+    Preferred base first, then the rest, skipping endpoints whose breaker is open.
+
+    Lazy on purpose: a half-open breaker only hands out its probe slot when the
+    caller actually moves on to that endpoint.
+    """
+    bases = _configured_bases()
+    if _preferred_base in bases:
+        bases.remove(_preferred_base)
+        bases.insert(0, _preferred_base)
+    for base in bases:
+        if _breaker_for(base).allow():
+            yield base
+
+
+def _answered_properly(status: int) -> bool:
+    """
+    Only a success or an auth decision shows the endpoint is the auth service;
+    a 404 or other unexpected 4xx (e.g. a misrouted base URL) counts as a failure.
+    """
+    return 200 <= status < 300 or status in (401, 403)
+
+
+def _record_endpoint(base: str, healthy: bool):
+    global _preferred_base
+    breaker = _breaker_for(base)
+    if healthy:
+        breaker.record_success()
+        _preferred_base = base
+    else:
+        breaker.record_failure()
+
+
+# Prometheus: 0 = closed, 1 = half-open, 2 = open
+_BREAKER_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+CallbackMetric(
+    "slip_auth_breaker_state",
+    "Auth endpoint circuit-breaker state (0 closed, 1 half-open, 2 open)",
+    ["endpoint"],
+    lambda: [((base,), _BREAKER_STATE_VALUES[breaker.state]) for base, breaker in list(_breakers.items())],
+)
+CallbackMetric(
+    "slip_auth_breaker_opened_total",
+    "Times each auth endpoint's circuit breaker opened",
+    ["endpoint"],
+    lambda: [((base,), breaker.opened_count) for base, breaker in list(_breakers.items())],
+    kind="counter",
+)
+
+
+def get_auth_endpoint_state() -> Dict[str, Any]:
+    """Preferred base URL and per-endpoint circuit-breaker state."""
+    return {
+        "preferred": _preferred_base,
+        "endpoints": {b: _breaker_for(b).snapshot() for b in _configured_bases()},
+    }
+
+
+# -----------------------------------------------------------------------------
+# Shared HTTP client
+# -----------------------------------------------------------------------------
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+async def init_auth_client() -> aiohttp.ClientSession:
+    """Create the pooled keep-alive session used for every auth-service call."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=AUTH_HTTP_POOL_SIZE,
+            limit_per_host=AUTH_HTTP_POOL_PER_HOST,
+            keepalive_timeout=AUTH_HTTP_KEEPALIVE_SEC,
+            use_dns_cache=True,
+            ttl_dns_cache=AUTH_HTTP_DNS_TTL_SEC,
+        )
+        _http_session = aiohttp.ClientSession(connector=connector)
+    return _http_session
+
+
+async def close_auth_client():
+    """Close the shared session and release its pooled connections."""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
 
 
 # -----------------------------------------------------------------------------
@@ -57,13 +213,22 @@ async def _request_json(
     url: str,
     headers: Dict[str, str],
     payload: Optional[Dict[str, Any]] = None,
-    timeout_sec: float = 10.0,
+    timeout_sec: float = AUTH_HTTP_TOTAL_TIMEOUT_SEC,
 ) -> Tuple[int, str, Optional[Dict[str, Any]]]:
     """Make an HTTP request and return (status, text, json_or_none) without double-reading."""
-    timeout = aiohttp.ClientTimeout(total=timeout_sec)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        req = session.post if method.upper() == "POST" else session.get
-        async with req(url, headers=headers, json=payload) as resp:
+    timeout = aiohttp.ClientTimeout(
+        total=timeout_sec,
+        sock_connect=AUTH_HTTP_CONNECT_TIMEOUT_SEC,
+        sock_read=AUTH_HTTP_READ_TIMEOUT_SEC,
+    )
+    # Falls back to lazy creation when called outside the app lifespan (scripts, tests)
+    session = await init_auth_client()
+    req = session.post if method.upper() == "POST" else session.get
+    start = time.perf_counter()
+    status_label = "error"
+    try:
+        async with req(url, headers=headers, json=payload, timeout=timeout) as resp:
+            status_label = str(resp.status)
             text = await resp.text()
             data: Optional[Dict[str, Any]] = None
             # Parse JSON leniently (even if server Content-Type is wrong)
@@ -75,17 +240,88 @@ async def _request_json(
                 except Exception:
                     data = None
             return resp.status, text, data
+    finally:
+        parts = urlsplit(url)
+        auth_request_seconds.observe(
+            time.perf_counter() - start,
+            endpoint=f"{parts.scheme}://{parts.netloc}",
+            path=parts.path,
+            status=status_label,
+        )
+
+
+# -----------------------------------------------------------------------------
+# Background health prober
+# -----------------------------------------------------------------------------
+_prober_task: Optional[asyncio.Task] = None
+
+
+async def _probe(base: str) -> bool:
+    try:
+        status, _text, _data = await _request_json(
+            "GET", f"{base}{AUTH_HEALTH_PROBE_PATH}", headers={}, timeout_sec=AUTH_HTTP_CONNECT_TIMEOUT_SEC * 2
+        )
+        return _answered_properly(status)
+    except Exception:
+        return False
+
+
+async def probe_auth_endpoints():
+    """Probe every candidate once and make the first healthy one (priority order) primary."""
+    global _preferred_base
+    bases = _configured_bases()
+    results = await asyncio.gather(*(_probe(b) for b in bases))
+    for base, healthy in zip(bases, results):
+        if healthy:
+            _breaker_for(base).record_success()
+        else:
+            _breaker_for(base).record_failure()
+    healthy_bases = [b for b, ok in zip(bases, results) if ok]
+    if healthy_bases:
+        _preferred_base = healthy_bases[0]
+
+
+async def _probe_loop():
+    while True:
+        try:
+            await probe_auth_endpoints()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Auth endpoint probe failed: %s", e)
+        await asyncio.sleep(AUTH_HEALTH_PROBE_INTERVAL_SEC)
+
+
+def start_auth_health_prober():
+    """Start the periodic endpoint prober (call from the app lifespan)."""
+    global _prober_task
+    if _prober_task is None or _prober_task.done():
+        _prober_task = asyncio.create_task(_probe_loop())
+
+
+async def stop_auth_health_prober():
+    global _prober_task
+    if _prober_task is not None:
+        _prober_task.cancel()
+        try:
+            await _prober_task
+        except asyncio.CancelledError:
+            pass
+        _prober_task = None
 
 
 # -----------------------------------------------------------------------------
 # Auth service calls
 # -----------------------------------------------------------------------------
-async def get_user_from_token(token: str) -> UserInfo:
+async def _fetch_user_info(token: str) -> UserInfo:
     """Resolve user info via GET /users/info with Bearer token."""
     headers = {"Authorization": f"Bearer {token}"}
-    for url in _candidate_urls("/users/info"):
+    for attempt, base in enumerate(_candidate_bases()):
+        if attempt:
+            retries_total.inc(downstream="auth")
         try:
-            status, _text, data = await _request_json("GET", url, headers=headers, timeout_sec=10)
+            status, _text, data = await _request_json("GET", f"{base}/users/info", headers=headers)
+            _record_endpoint(base, _answered_properly(status))
             if status == 200 and isinstance(data, dict):
                 user_id = str(data.get("id", "")).strip()
                 role = str(data.get("role", "")).strip()
@@ -100,26 +336,28 @@ async def get_user_from_token(token: str) -> UserInfo:
             continue
 
         except (aiohttp.ClientError, asyncio.TimeoutError):
+            _record_endpoint(base, False)
             continue
         except HTTPException:
             raise
         except Exception:
+            _record_endpoint(base, False)
             continue
 
-    if BYPASS_AUTH:
-        return UserInfo(user_id="dev-user", role="organizer", token=token)
-
     raise HTTPException(status_code=503, detail="Authentication service is currently unavailable")
 
 
-async def call_auth_service(token: str, user_id: str, required_role: str) -> bool:
+async def _fetch_verification(token: str, user_id: str, required_role: str) -> bool:
     """Verify authorization via POST /users/verify with Bearer token."""
     headers = {"Authorization": f"Bearer {token}"}
     payload = {"uuid": user_id, "required_role": required_role}
 
-    for url in _candidate_urls("/users/verify"):
+    for attempt, base in enumerate(_candidate_bases()):
+        if attempt:
+            retries_total.inc(downstream="auth")
         try:
-            status, _text, data = await _request_json("POST", url, headers=headers, payload=payload, timeout_sec=10)
+            status, _text, data = await _request_json("POST", f"{base}/users/verify", headers=headers, payload=payload)
+            _record_endpoint(base, _answered_properly(status))
             if status == 200 and isinstance(data, dict):
                 return bool(data.get("verify", False))
             if status == 401:
@@ -131,16 +369,211 @@ async def call_auth_service(token: str, user_id: str, required_role: str) -> boo
             continue
 
         except (aiohttp.ClientError, asyncio.TimeoutError):
+            _record_endpoint(base, False)
             continue
         except HTTPException:
             raise
         except Exception:
+            _record_endpoint(base, False)
             continue
 
-    if BYPASS_AUTH:
+    raise HTTPException(status_code=503, detail="Authentication service is currently unavailable")
+
+
+# -----------------------------------------------------------------------------
+# Local JWT verification
+# -----------------------------------------------------------------------------
+_hmac_key: Optional[str] = None
+_public_key: Optional[str] = None
+_jwks: Dict[str, Dict[str, Any]] = {}
+_jwks_loaded_at = 0.0
+
+
+def _load_jwks():
+    """(Re)read the JWKS file into a kid -> JWK map."""
+    global _jwks, _jwks_loaded_at
+    _jwks_loaded_at = time.monotonic()
+    try:
+        with open(AUTH_JWT_JWKS_FILE) as f:
+            keys = json.load(f).get("keys", [])
+    except (OSError, ValueError) as e:
+        logger.error("Failed to load JWKS file %s: %s", AUTH_JWT_JWKS_FILE, e)
+        return
+    _jwks = {k["kid"]: k for k in keys if isinstance(k, dict) and k.get("kid")}
+    logger.info("Loaded %d JWKS keys", len(_jwks))
+
+
+def load_jwt_keys():
+    """Load verification keys for local mode; call once at startup."""
+    global _hmac_key, _public_key
+    if AUTH_VERIFY_MODE != "local":
+        return
+    _hmac_key = AUTH_JWT_SECRET or None
+    if AUTH_JWT_PUBLIC_KEY_FILE:
+        try:
+            with open(AUTH_JWT_PUBLIC_KEY_FILE) as f:
+                _public_key = f.read()
+        except OSError as e:
+            logger.error("Failed to read JWT public key %s: %s", AUTH_JWT_PUBLIC_KEY_FILE, e)
+    if AUTH_JWT_JWKS_FILE:
+        _load_jwks()
+    if not (_hmac_key or _public_key or _jwks):
+        logger.warning("AUTH_VERIFY_MODE=local but no JWT key configured; using the auth service")
+
+
+def _select_key(header: Dict[str, Any]) -> Optional[Any]:
+    """Pick the verification key for a token header, reloading JWKS on an unknown kid."""
+    kid = header.get("kid")
+    if kid and AUTH_JWT_JWKS_FILE:
+        if kid not in _jwks and time.monotonic() - _jwks_loaded_at >= AUTH_JWT_JWKS_RELOAD_SEC:
+            _load_jwks()
+        if kid in _jwks:
+            return _jwks[kid]
+    alg = str(header.get("alg", ""))
+    if alg.startswith("HS"):
+        return _hmac_key
+    return _public_key
+
+
+# JWK key type each algorithm family needs; a mismatch can never verify
+_ALG_KEY_TYPES = {"HS": "oct", "RS": "RSA", "PS": "RSA", "ES": "EC"}
+
+
+def _key_matches_alg(key: Any, alg: str) -> bool:
+    """A JWKS key only verifies tokens of its own type (and its own alg, if it declares one)."""
+    if not isinstance(key, dict):
         return True
+    if key.get("alg") and key["alg"] != alg:
+        return False
+    return key.get("kty") == _ALG_KEY_TYPES.get(alg[:2])
 
-    raise HTTPException(status_code=503, detail="Authentication service is currently unavailable")
+
+def _verify_locally(token: str) -> Optional[UserInfo]:
+    """
+    Validate signature, expiry and claims without network I/O.
+
+    Returns None when the token cannot be decided here (no matching key or
+    missing claims) so the caller can fall back to the auth service.
+    Raises 401 when the token is definitely invalid or expired, or its header
+    names an algorithm outside AUTH_JWT_ALGORITHMS or one its key cannot use.
+    """
+    if AUTH_VERIFY_MODE != "local":
+        return None
+    try:
+        header = jwt.get_unverified_header(token)
+    except JOSEError:
+        return None
+    alg = header.get("alg")
+    if alg not in AUTH_JWT_ALGORITHMS:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    key = _select_key(header)
+    if not key:
+        return None
+    if not _key_matches_alg(key, alg):
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    try:
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=[alg],
+            audience=AUTH_JWT_AUDIENCE or None,
+            issuer=AUTH_JWT_ISSUER or None,
+            options={"verify_aud": bool(AUTH_JWT_AUDIENCE), "require_exp": True},
+        )
+    except JOSEError:  # JWTError (expired, bad claims) and JWKError (unusable key) alike
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    user_id = str(claims.get(AUTH_JWT_USER_ID_CLAIM, "")).strip()
+    role = str(claims.get(AUTH_JWT_ROLE_CLAIM, "")).strip()
+    if not user_id or not role:
+        return None
+    return UserInfo(user_id=user_id, role=role, token=token)
+
+
+# -----------------------------------------------------------------------------
+# Cached lookups
+# -----------------------------------------------------------------------------
+_MISSING = object()
+# Only definitive rejections are cached negatively; 5xx/unavailable always retries
+_NEGATIVE_STATUSES = (401, 403)
+
+_user_cache = TTLCache(maxsize=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL_SEC)
+_verify_cache = TTLCache(maxsize=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL_SEC)
+_user_flight = SingleFlight()
+_verify_flight = SingleFlight()
+register_cache("auth_user", _user_cache)
+register_cache("auth_verify", _verify_cache)
+
+
+async def _cached_call(cache: TTLCache, flight: SingleFlight, key, fetch):
+    """Serve `key` from cache, otherwise run `fetch` once for all concurrent callers."""
+    cached = cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        if isinstance(cached, _Rejection):
+            raise HTTPException(status_code=cached.status_code, detail=cached.detail)
+        return cached
+
+    async def _load():
+        try:
+            # One admission slot per coalesced remote call
+            async with get_limiter("auth").slot():
+                value = await fetch()
+        except HTTPException as e:
+            if e.status_code in _NEGATIVE_STATUSES:
+                cache.set(key, _Rejection(e.status_code, e.detail), ttl=AUTH_CACHE_NEGATIVE_TTL_SEC)
+            raise
+        cache.set(key, value)
+        return value
+
+    return await flight.do(key, _load)
+
+
+def _bypassable(e: HTTPException) -> bool:
+    """
+    BYPASS_AUTH only covers an unreachable auth service; a 503 from our own
+    admission limiter is load shedding and must reach the client with Retry-After.
+    """
+    return BYPASS_AUTH and e.status_code == 503 and not isinstance(e, Overloaded)
+
+
+async def get_user_from_token(token: str) -> UserInfo:
+    """Resolve user info for a Bearer token (local JWT, else cached/coalesced remote)."""
+    with stage("auth_user"):
+        user = _verify_locally(token)
+        if user is not None:
+            return user
+        try:
+            return await _cached_call(_user_cache, _user_flight, token, lambda: _fetch_user_info(token))
+        except HTTPException as e:
+            if _bypassable(e):
+                return UserInfo(user_id="dev-user", role="organizer", token=token)
+            raise
+
+
+async def call_auth_service(token: str, user_id: str, required_role: str) -> bool:
+    """Verify that the token's user holds `required_role` (local JWT, else cached/coalesced remote)."""
+    with stage("auth_verify"):
+        user = _verify_locally(token)
+        if user is not None and user.user_id == user_id:
+            return user.role == required_role
+        key = (token, user_id, required_role)
+        try:
+            return await _cached_call(
+                _verify_cache, _verify_flight, key, lambda: _fetch_verification(token, user_id, required_role)
+            )
+        except HTTPException as e:
+            if _bypassable(e):
+                return True
+            raise
+
+
+def get_auth_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters for the token caches, used to tune AUTH_CACHE_TTL_SEC."""
+    return {
+        "user_info": {**_user_cache.stats(), "coalesced": _user_flight.shared},
+        "verify": {**_verify_cache.stats(), "coalesced": _verify_flight.shared},
+    }
 
 
 # -----------------------------------------------------------------------------
@@ -1,12 +1,94 @@
+import io
 import os
+import asyncio
+import hashlib
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Tuple
 from fastapi import UploadFile, HTTPException
 from PIL import Image
+from app.core.config import settings
+from app.utils.metrics import CallbackMetric
 
 MAX_MB = 5
 MAX_BYTES = MAX_MB * 1024 * 1024
+# Enough for the header of any supported format, including JPEGs with large EXIF blocks
+HEADER_BYTES = 128 * 1024
+# Decoded size limit; a small file can still expand to gigabytes of pixels
+MAX_PIXELS = settings.IMAGE_MAX_PIXELS
 
-def validate_image(upload: UploadFile, max_bytes: int = MAX_BYTES):
-    # --- 1️⃣ Check file size ---
+# Leading bytes of the formats we accept; anything else is rejected before Pillow runs
+_MAGIC_NUMBERS = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+)
+SNIFF_BYTES = 16
+
+
+@dataclass(frozen=True)
+class ValidatedImage:
+    format: str
+    # Hex SHA-256 of the upload, taken from the same read as the validation
+    sha256: str
+
+
+class ImageRejected(Exception):
+    """Raised inside the validation pool; converted to HTTPException by the caller."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Return the image format from its magic bytes, or None if it is not one we accept."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for magic, fmt in _MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return fmt
+    return None
+
+
+def _check_image(fp, max_pixels: int) -> str:
+    """Magic bytes, pixel-count limit, then Pillow verify. Runs in the validation pool."""
+    fp.seek(0)
+    if sniff_image_type(fp.read(SNIFF_BYTES)) is None:
+        raise ImageRejected(400, "Only image files are allowed")
+    fp.seek(0)
+    try:
+        img = Image.open(fp)
+        if img.width * img.height > max_pixels:
+            raise ImageRejected(413, "Image dimensions too large")
+        img.verify()  # verifies header, doesn’t fully decode
+        return img.format
+    except ImageRejected:
+        raise
+    except Exception:
+        raise ImageRejected(400, "Invalid or corrupted image file")
+    finally:
+        fp.seek(0)  # rewind for next consumer (e.g., S3 upload)
+
+
+def _check_image_bytes(data: bytes, max_pixels: int) -> Tuple[str, str]:
+    """
+    Pool entry point: validate the upload's bytes and hash them in the same job
+    (bytes also cross the process boundary, file objects do not)
+
+    Returns:
+        (image format, hex SHA-256)
+    """
+    fmt = _check_image(io.BytesIO(data), max_pixels)
+    return fmt, hashlib.sha256(data).hexdigest()
+
+
+def _check_size(upload: UploadFile, max_bytes: int):
     upload.file.seek(0, os.SEEK_END)
     size = upload.file.tell()
     upload.file.seek(0)
@@ -19,11 +101,119 @@ def validate_image(upload: UploadFile, max_bytes: int = MAX_BYTES):
             detail=f"File too large (>{MAX_MB} MB)",
         )
 
+
+def validate_image(upload: UploadFile, max_bytes: int = MAX_BYTES):
+    # --- 1️⃣ Check file size ---
+    _check_size(upload, max_bytes)
+
     # --- 2️⃣ Check image integrity ---
     try:
-        img = Image.open(upload.file)
-        img.verify()  # verifies header, doesn’t fully decode
+        _check_image(upload.file, MAX_PIXELS)
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+# -----------------------------------------------------------------------------
+# Validation pool
+# -----------------------------------------------------------------------------
+_pool: Optional[Executor] = None
+_in_flight = 0
+_validated = 0
+_rejected = 0
+
+
+def _get_pool() -> Executor:
+    global _pool
+    if _pool is None:
+        if settings.IMAGE_VALIDATION_POOL == "process":
+            _pool = ProcessPoolExecutor(max_workers=settings.IMAGE_VALIDATION_WORKERS)
+        else:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_VALIDATION_WORKERS, thread_name_prefix="image-check"
+            )
+    return _pool
+
+
+async def validate_image_async(upload: UploadFile, max_bytes: int = MAX_BYTES) -> ValidatedImage:
+    """
+    validate_image for async routes: size and magic-byte checks run inline (cheap),
+    Pillow runs in the bounded validation pool so big uploads never stall the loop.
+    The upload (at most `max_bytes`) is read once, and that read is both validated
+    and hashed, so content addressing never reads the spooled file again.
+
+    Returns:
+        The detected image format (e.g. "JPEG") and the SHA-256 of the upload
+    """
+    global _in_flight, _validated, _rejected
+    _check_size(upload, max_bytes)
+
+    # Early rejection: a non-image never reaches the pool
+    head = upload.file.read(SNIFF_BYTES)
+    upload.file.seek(0)
+    if sniff_image_type(head) is None:
+        _rejected += 1
+        raise HTTPException(status_code=400, detail="Only image files are allowed")
+
+    loop = asyncio.get_running_loop()
+    _in_flight += 1
+    try:
+        # The spooled upload may be on disk: read it off the loop
+        data = await loop.run_in_executor(None, upload.file.read)
+        upload.file.seek(0)
+        fmt, sha256 = await loop.run_in_executor(_get_pool(), _check_image_bytes, data, MAX_PIXELS)
+    except ImageRejected as e:
+        _rejected += 1
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        _in_flight -= 1
+    _validated += 1
+    return ValidatedImage(format=fmt, sha256=sha256)
+
+
+async def run_in_image_pool(fn, *args):
+    """Run CPU-bound image work in the shared image pool (args must be picklable in process mode)."""
+    global _in_flight
+    loop = asyncio.get_running_loop()
+    _in_flight += 1
+    try:
+        return await loop.run_in_executor(_get_pool(), fn, *args)
+    finally:
+        _in_flight -= 1
+
+
+CallbackMetric("slip_image_pool_in_flight", "Jobs running or queued in the image pool", [], lambda: [((), _in_flight)])
+CallbackMetric("slip_image_pool_workers", "Image pool size", [], lambda: [((), settings.IMAGE_VALIDATION_WORKERS)])
+CallbackMetric(
+    "slip_images_rejected_total", "Uploads rejected by image validation", [], lambda: [((), _rejected)], kind="counter"
+)
+
+
+def get_image_pool_stats() -> dict:
+    return {
+        "kind": settings.IMAGE_VALIDATION_POOL,
+        "workers": settings.IMAGE_VALIDATION_WORKERS,
+        "in_flight": _in_flight,
+        "queued": max(_in_flight - settings.IMAGE_VALIDATION_WORKERS, 0),
+        "validated": _validated,
+        "rejected": _rejected,
+    }
+
+
+def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def validate_image_header(head: bytes) -> str:
+    """Check the leading bytes of a stored object parse as an image; return its format."""
+    if sniff_image_type(head) is None:
+        raise HTTPException(status_code=400, detail="Only image files are allowed")
+    try:
+        img = Image.open(io.BytesIO(head))  # parses the header only, no pixel decode
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid or corrupted image file")
-    finally:
-        upload.file.seek(0)  # rewind for next consumer (e.g., S3 upload)
\ No newline at end of file
+    if img.width * img.height > MAX_PIXELS:
+        raise HTTPException(status_code=413, detail="Image dimensions too large")
+    return img.format
@@ -0,0 +1,92 @@
+import io
+import asyncio
+from dataclasses import dataclass
+from fastapi import UploadFile, HTTPException
+from PIL import Image, ImageOps
+from app.core.config import settings
+from app.core.image_check import run_in_image_pool
+
+# Output format -> (content type, file extension)
+_OUTPUT_FORMATS = {
+    "WEBP": ("image/webp", ".webp"),
+    "JPEG": ("image/jpeg", ".jpg"),
+}
+
+THUMBNAIL_PREFIX = "thumbnails/"
+
+
+@dataclass
+class NormalizedImage:
+    data: bytes
+    content_type: str
+    extension: str
+    thumbnail: bytes
+
+
+def thumbnail_key(slip_key: str) -> str:
+    """S3 key of the thumbnail stored next to a normalized slip."""
+    return f"{THUMBNAIL_PREFIX}{slip_key}"
+
+
+def _to_8bit(img: Image.Image) -> Image.Image:
+    """
+    Bring modes neither output format can encode (16-bit greyscale PNGs load as
+    I;16 or I, float images as F) down to 8-bit L, scaling 16-bit values rather
+    than clipping them to white; other unusual modes (CMYK, LAB, 1, ...) become RGB(A).
+    """
+    if img.mode.startswith("I;16"):
+        img = img.convert("I")
+    if img.mode == "I":
+        return img.point(lambda value: value / 256).convert("L")
+    if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+        return img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    return img
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    if fmt == "JPEG" and img.mode != "RGB":
+        img = img.convert("RGB")
+    elif fmt == "WEBP" and img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or img.mode == "P" else "RGB")
+    out = io.BytesIO()
+    # No exif= argument: the re-encoded file carries no EXIF (GPS, device, ...)
+    img.save(out, format=fmt, quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def normalize_image(data: bytes, fmt: str, quality: int, max_dimension: int, thumbnail_size: int) -> NormalizedImage:
+    """
+    Strip EXIF, downscale and re-encode one image, and build its thumbnail.
+    Pure function so it can run in the thread or process image pool.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        # Apply the EXIF orientation before the EXIF block is dropped
+        img = _to_8bit(ImageOps.exif_transpose(img))
+        img.thumbnail((max_dimension, max_dimension))
+        full = _encode(img, fmt, quality)
+
+        thumb = img.copy()
+        thumb.thumbnail((thumbnail_size, thumbnail_size))
+        thumbnail = _encode(thumb, fmt, quality)
+
+    content_type, extension = _OUTPUT_FORMATS[fmt]
+    return NormalizedImage(data=full, content_type=content_type, extension=extension, thumbnail=thumbnail)
+
+
+async def normalize_upload(upload: UploadFile) -> NormalizedImage:
+    """Normalize an already validated upload in the image pool."""
+    fmt = settings.IMAGE_OUTPUT_FORMAT
+    upload.file.seek(0)
+    data = await asyncio.get_running_loop().run_in_executor(None, upload.file.read)
+    upload.file.seek(0)
+    try:
+        return await run_in_image_pool(
+            normalize_image,
+            data,
+            fmt,
+            settings.IMAGE_OUTPUT_QUALITY,
+            settings.IMAGE_MAX_DIMENSION,
+            settings.IMAGE_THUMBNAIL_SIZE,
+        )
+    except (OSError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid or corrupted image file")
@@ -1,10 +1,132 @@
+import os
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
-from typing import List, Optional
-from app.db.mongo import get_database
+from bson.errors import InvalidId
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from app.db.mongo import get_database, get_client
+from app.db.group_commit import GroupCommitWriter
 from app.core.config import settings
+from app.utils.admission import get_limiter
+from app.utils.cache import LocalCacheBackend, RedisCacheBackend, SingleFlight
+from app.utils.metrics import mongo_request_seconds, register_cache, timed
 
-async def create_slip(slip_key: str, market_id: str, vendor_reservation_id: str) -> dict:
+# Fields the listing endpoints need (_id is always returned)
+SLIP_LIST_PROJECTION = {"slipKey": 1, "thumbKey": 1, "marketID": 1, "vendorReservationID": 1}
+# Largest page get_slips_page serves from the cached first page of a reservation
+MAX_CACHED_PAGE_SIZE = 200
+
+# Optional group-commit writer shared by concurrent create_slip calls
+_slip_writer: Optional[GroupCommitWriter] = None
+
+def get_slip_writer() -> GroupCommitWriter:
+    """Return the slips group-commit writer, creating it on first use."""
+    global _slip_writer
+    if _slip_writer is None:
+        _slip_writer = GroupCommitWriter(
+            lambda: get_database()[settings.MONGO_DB_SLIP],
+            max_docs=settings.MONGO_GROUP_COMMIT_MAX_DOCS,
+            window_ms=settings.MONGO_GROUP_COMMIT_WINDOW_MS,
+        )
+    return _slip_writer
+
+async def close_slip_writer():
+    """Flush pending group-commit inserts (call on shutdown)."""
+    if _slip_writer is not None:
+        await _slip_writer.close()
+
+# Read-through cache for slips by ID and per reservation. Slips never change after
+# creation, so only create/delete invalidate; the TTL bounds staleness on workers
+# that did not see the write (local backend) or missed an invalidation.
+def _slip_cache_ttl() -> float:
+    ttl = settings.SLIP_CACHE_TTL_SEC
+    if settings.SLIP_CACHE_BACKEND != "redis" and (settings.SERVER_WORKERS or os.cpu_count() or 1) > 1:
+        # Local invalidations never reach the other workers, and neither do the
+        # deletes of the retention sweeper or the reconciler: keep entries short
+        ttl = min(ttl, settings.SLIP_CACHE_LOCAL_MULTI_WORKER_TTL_SEC)
+    return ttl
+
+def _make_slip_cache():
+    if settings.SLIP_CACHE_BACKEND == "redis":
+        return RedisCacheBackend(settings.SLIP_CACHE_REDIS_URL, ttl=_slip_cache_ttl())
+    return LocalCacheBackend(maxsize=settings.SLIP_CACHE_SIZE, ttl=_slip_cache_ttl())
+
+slip_cache = _make_slip_cache()
+register_cache("slips", slip_cache)
+_slip_flight = SingleFlight()
+
+def _slip_cache_key(slip_id: str) -> str:
+    return f"slip:{slip_id}"
+
+def _reservation_cache_key(vendor_reservation_id: str) -> str:
+    return f"reservation:{vendor_reservation_id}"
+
+async def _cached_read(key: str, load: Callable[[], Awaitable[Any]], is_negative: Callable[[Any], bool]) -> Any:
+    """
+    Return the cached value for `key`, or load it once for all concurrent callers
+    and cache it (negative results with the shorter SLIP_CACHE_NEGATIVE_TTL_SEC)
+    """
+    if not settings.SLIP_CACHE_ENABLED:
+        return await load()
+    found, value = await slip_cache.get(key)
+    if found:
+        return value
+
+    async def _load_and_fill():
+        value = await load()
+        # An invalidation of this key while it loaded forgets this load: the value
+        # may predate the write, so it is returned to its waiters but not cached
+        if _slip_flight.is_current(key):
+            ttl = min(settings.SLIP_CACHE_NEGATIVE_TTL_SEC, _slip_cache_ttl()) if is_negative(value) else None
+            await slip_cache.set(key, value, ttl=ttl)
+            if not _slip_flight.is_current(key):
+                # Invalidated while the (Redis) write was on the wire
+                await slip_cache.delete(key)
+        return value
+
+    return await _slip_flight.do(key, _load_and_fill)
+
+async def _invalidate_slip_cache(slip_ids: Iterable[Any] = (), reservation_ids: Iterable[str] = ()):
+    if not settings.SLIP_CACHE_ENABLED:
+        return
+    keys = [_slip_cache_key(str(slip_id)) for slip_id in slip_ids]
+    keys.extend(_reservation_cache_key(reservation_id) for reservation_id in reservation_ids if reservation_id)
+    # Later reads of these keys start a new load instead of joining one that
+    # may have read the old state; loads of other keys are unaffected
+    for key in keys:
+        _slip_flight.forget(key)
+    await slip_cache.delete(*keys)
+
+async def close_slip_cache():
+    """Drop the slip cache / close its Redis connection (call on shutdown)."""
+    await slip_cache.close()
+
+def get_slip_cache_stats() -> Dict[str, Any]:
+    return slip_cache.stats()
+
+def _outbox_document(slip_data: dict, event: Dict[str, Any]) -> dict:
+    """Outbox entry for the reservation-status event that goes with a new slip."""
+    now = datetime.now(timezone.utc)
+    return {
+        "slipId": slip_data["_id"],
+        "reservationId": slip_data["vendorReservationID"],
+        "marketId": slip_data["marketID"],
+        "status": event["status"],
+        "payload": event.get("payload"),
+        "state": "pending",
+        "attempts": 0,
+        "createdAt": now,
+        "nextAttemptAt": now,
+    }
+
+async def create_slip(
+    slip_key: str,
+    market_id: str,
+    vendor_reservation_id: str,
+    outbox_event: Optional[Dict[str, Any]] = None,
+    thumb_key: Optional[str] = None,
+    content_hash: Optional[str] = None,
+) -> dict:
     """
     Create a new slip record
     
@@ -12,55 +134,238 @@ async def create_slip(slip_key: str, market_id: str, vendor_reservation_id: str)
         slip_key: The S3 key for the uploaded slip image
         market_id: The ID of the market
         vendor_reservation_id: The ID of the vendor reservation
+        thumb_key: The S3 key of the slip's thumbnail, if one was generated
+        content_hash: SHA-256 of the uploaded bytes; unique per reservation
+        outbox_event: Reservation-status event ({"status", "payload"}) to write to the
+            outbox in the same transaction; the outbox relay publishes it later
         
     Returns:
         The newly created slip document
+        
+    Raises:
+        DuplicateKeyError: If the reservation already has a slip with this content_hash
+        Overloaded: If the Mongo admission limit stays saturated past its deadline
     """
     db = get_database()
     slip_collection = db[settings.MONGO_DB_SLIP]
     
     # Create the slip record
     slip_data = {
+        "_id": ObjectId(),
         "slipKey": slip_key,
         "marketID": market_id,
         "vendorReservationID": vendor_reservation_id
     }
+    if thumb_key:
+        slip_data["thumbKey"] = thumb_key
+    if content_hash:
+        slip_data["contentHash"] = content_hash
     
-    result = await slip_collection.insert_one(slip_data)
+    # Upload-path writes are admission-limited; reads are not, so listings stay fast during upload surges
+    async with get_limiter("mongo").slot():
+        if outbox_event is not None:
+            outbox_collection = db[settings.MONGO_DB_OUTBOX]
+            outbox_data = _outbox_document(slip_data, outbox_event)
+            
+            async def _write(session):
+                await slip_collection.insert_one(slip_data, session=session)
+                await outbox_collection.insert_one(outbox_data, session=session)
+            
+            # Slip and event commit together, so an event can neither be lost nor refer to a missing slip
+            with mongo_request_seconds.time(operation="insert_slip_with_outbox"):
+                async with await get_client().start_session() as session:
+                    await session.with_transaction(_write)
+        elif settings.MONGO_GROUP_COMMIT:
+            with mongo_request_seconds.time(operation="insert_slip_group_commit"):
+                await get_slip_writer().insert(slip_data)
+        else:
+            with mongo_request_seconds.time(operation="insert_slip"):
+                await slip_collection.insert_one(slip_data)
     
-    # Fetch the created document
-    created_slip = await slip_collection.find_one({"_id": result.inserted_id})
-    created_slip["id"] = str(created_slip["_id"])
+    # Both paths set slip_data["_id"], so no read-back is needed
+    slip_data["id"] = str(slip_data["_id"])
+    await _invalidate_slip_cache([slip_data["_id"]], [vendor_reservation_id])
     
-    return created_slip
+    return slip_data
 
-async def get_slips_by_reservation_id(vendor_reservation_id: str) -> List[dict]:
+@timed(mongo_request_seconds, operation="find_slip_by_content_hash")
+async def get_slip_by_content_hash(vendor_reservation_id: str, content_hash: str) -> Optional[dict]:
     """
-    Get all slip records associated with a specific reservation ID
+    Find a reservation's slip by the SHA-256 of its image
     
     Args:
         vendor_reservation_id: The ID of the vendor reservation
+        content_hash: Hex SHA-256 of the uploaded bytes
         
     Returns:
-        List of slip documents
+        The slip document or None if this image was never uploaded for the reservation
     """
     db = get_database()
     slip_collection = db[settings.MONGO_DB_SLIP]
     
-    # Query the collection
-    cursor = slip_collection.find({"vendorReservationID": vendor_reservation_id})
+    slip = await slip_collection.find_one(
+        {"vendorReservationID": vendor_reservation_id, "contentHash": content_hash}
+    )
+    if slip:
+        slip["id"] = str(slip["_id"])
+    return slip
+
+@timed(mongo_request_seconds, operation="find_slip_by_key")
+async def get_slip_by_key(slip_key: str) -> Optional[dict]:
+    """
+    Find the slip recorded for an S3 object
+    
+    Args:
+        slip_key: The S3 key of the slip image
+        
+    Returns:
+        The slip document or None if no slip points at this object
+    """
+    db = get_database()
+    slip_collection = db[settings.MONGO_DB_SLIP]
     
-    # Convert ObjectId to string for each document
+    slip = await slip_collection.find_one({"slipKey": slip_key})
+    if slip:
+        slip["id"] = str(slip["_id"])
+    return slip
+
+async def _find_slips(query: Dict[str, Any], limit: int) -> List[dict]:
+    slip_collection = get_database()[settings.MONGO_DB_SLIP]
+    cursor = slip_collection.find(query, SLIP_LIST_PROJECTION).sort("_id", 1).limit(limit)
     slips = []
+    with mongo_request_seconds.time(operation="find_slips_page"):
+        async for slip in cursor:
+            slip["id"] = str(slip["_id"])
+            slips.append(slip)
+    return slips
+
+async def get_slips_page(
+    vendor_reservation_id: str,
+    limit: int,
+    after: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Get one page of slips for a reservation using keyset pagination on _id
+    
+    First pages come from a per-reservation cache of the first
+    MAX_CACHED_PAGE_SIZE + 1 slips, so any page size up to that is a slice of it.
+    
+    Args:
+        vendor_reservation_id: The ID of the vendor reservation
+        limit: Maximum number of slips in the page
+        after: Cursor from the previous page (the last slip ID it returned)
+        
+    Returns:
+        (slips, next_cursor); next_cursor is None on the last page
+        
+    Raises:
+        ValueError: If `after` is not a valid cursor
+    """
+    query: Dict[str, Any] = {"vendorReservationID": vendor_reservation_id}
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise ValueError(f"Invalid cursor: {after}")
+    
+    # Fetch one extra document to know whether another page exists
+    if not after and limit <= MAX_CACHED_PAGE_SIZE:
+        head = await _cached_read(
+            _reservation_cache_key(vendor_reservation_id),
+            lambda: _find_slips(query, MAX_CACHED_PAGE_SIZE + 1),
+            lambda slips: not slips,
+        )
+        # Copies, so callers never mutate the cached documents
+        slips = [dict(slip) for slip in head[:limit + 1]]
+    else:
+        slips = await _find_slips(query, limit + 1)
+    
+    next_cursor = None
+    if len(slips) > limit:
+        slips = slips[:limit]
+        next_cursor = slips[-1]["id"]
+    return slips, next_cursor
+
+async def iter_slips(
+    vendor_reservation_id: Optional[str] = None,
+    market_id: Optional[str] = None,
+    batch_size: int = 100,
+) -> AsyncIterator[dict]:
+    """
+    Stream slips for a reservation or a whole market as the cursor yields them
+    
+    Args:
+        vendor_reservation_id: The ID of the vendor reservation
+        market_id: The ID of the market (used when no reservation ID is given)
+        batch_size: Documents fetched per round trip
+        
+    Yields:
+        Slip documents with only the listing fields
+    """
+    db = get_database()
+    slip_collection = db[settings.MONGO_DB_SLIP]
+    
+    if vendor_reservation_id is not None:
+        query = {"vendorReservationID": vendor_reservation_id}
+    else:
+        query = {"marketID": market_id}
+    
+    cursor = slip_collection.find(query, SLIP_LIST_PROJECTION).batch_size(batch_size)
     async for slip in cursor:
         slip["id"] = str(slip["_id"])
-        slips.append(slip)
+        yield slip
+
+@timed(mongo_request_seconds, operation="find_slip_keys")
+async def get_slip_keys_for_reservations(
+    vendor_reservation_ids: Optional[List[str]] = None,
+    market_id: Optional[str] = None,
+    limit: int = 500,
+    after: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Get one page of slip keys for many reservations in one query (keyset pagination on _id)
+    
+    Args:
+        vendor_reservation_ids: Reservation IDs to match with $in
+        market_id: Match every reservation in this market instead
+        limit: Maximum number of slips in the page
+        after: Cursor from the previous page (the last slip ID it returned)
         
-    return slips
+    Returns:
+        (slips, next_cursor); slips hold only _id, slipKey, thumbKey and
+        vendorReservationID, and next_cursor is None on the last page
+        
+    Raises:
+        ValueError: If `after` is not a valid cursor
+    """
+    db = get_database()
+    slip_collection = db[settings.MONGO_DB_SLIP]
+    
+    if market_id is not None:
+        query: Dict[str, Any] = {"marketID": market_id}
+    else:
+        query = {"vendorReservationID": {"$in": vendor_reservation_ids or []}}
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise ValueError(f"Invalid cursor: {after}")
+    
+    cursor = (
+        slip_collection.find(query, {"slipKey": 1, "thumbKey": 1, "vendorReservationID": 1})
+        .sort("_id", 1)
+        .limit(limit + 1)
+    )
+    slips = [slip async for slip in cursor]
+    next_cursor = None
+    if len(slips) > limit:
+        slips = slips[:limit]
+        next_cursor = str(slips[-1]["_id"])
+    return slips, next_cursor
 
 async def get_slip_by_id(slip_id: str) -> Optional[dict]:
     """
-    Get a slip record by its ID
+    Get a slip record by its ID (cached, including unknown IDs)
     
     Args:
         slip_id: The ID of the slip to retrieve
@@ -68,21 +373,25 @@ async def get_slip_by_id(slip_id: str) -> Optional[dict]:
     Returns:
         The slip document or None if not found
     """
-    db = get_database()
-    slip_collection = db[settings.MONGO_DB_SLIP]
-    
     try:
         # Convert string ID to ObjectId
         object_id = ObjectId(slip_id)
-        slip = await slip_collection.find_one({"_id": object_id})
-        
+    except (InvalidId, TypeError):
+        return None
+    
+    async def _load() -> Optional[dict]:
+        db = get_database()
+        slip_collection = db[settings.MONGO_DB_SLIP]
+        with mongo_request_seconds.time(operation="find_slip_by_id"):
+            slip = await slip_collection.find_one({"_id": object_id})
         if slip:
             slip["id"] = str(slip["_id"])
-            return slip
-        return None
-    except:
-        return None
+        return slip
+    
+    slip = await _cached_read(_slip_cache_key(str(object_id)), _load, lambda slip: slip is None)
+    return dict(slip) if slip else None
 
+@timed(mongo_request_seconds, operation="delete_slip")
 async def delete_slip(slip_id: str) -> bool:
     """
     Delete a slip record
@@ -99,7 +408,31 @@ async def delete_slip(slip_id: str) -> bool:
     try:
         # Convert string ID to ObjectId
         object_id = ObjectId(slip_id)
-        result = await slip_collection.delete_one({"_id": object_id})
-        return result.deleted_count > 0
+        # find_one_and_delete returns the reservation whose cached listing must go too
+        deleted = await slip_collection.find_one_and_delete({"_id": object_id}, {"vendorReservationID": 1})
     except:
         return False
+    if deleted is None:
+        return False
+    await _invalidate_slip_cache([object_id], [deleted.get("vendorReservationID")])
+    return True
+
+
+@timed(mongo_request_seconds, operation="delete_slips")
+async def delete_slips(slip_ids: List[ObjectId]) -> int:
+    """
+    Delete many slip records with one delete_many
+
+    Args:
+        slip_ids: ObjectIds of the slips to delete
+
+    Returns:
+        Number of records deleted
+    """
+    if not slip_ids:
+        return 0
+    slip_collection = get_database()[settings.MONGO_DB_SLIP]
+    reservation_ids = await slip_collection.distinct("vendorReservationID", {"_id": {"$in": slip_ids}})
+    result = await slip_collection.delete_many({"_id": {"$in": slip_ids}})
+    await _invalidate_slip_cache(slip_ids, reservation_ids)
+    return result.deleted_count
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Any, Callable, List, Optional, Set, Tuple
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """
+    Gather concurrent single-document inserts into one insert_many(ordered=False)
+
+    A batch is written once it holds `max_docs` documents or `window_ms` after its
+    first document arrived, whichever comes first. Every caller gets back its own
+    `_id`, or the error for its own document.
+
+    Args:
+        get_collection: Returns the Motor collection to write to
+        max_docs: Flush as soon as this many documents are waiting
+        window_ms: Longest time a document waits for others to join its batch
+    """
+
+    def __init__(self, get_collection: Callable[[], Any], max_docs: int = 64, window_ms: float = 5):
+        self._get_collection = get_collection
+        self.max_docs = max_docs
+        self.window = window_ms / 1000
+        self.batches = 0
+        self.documents = 0
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writes: Set[asyncio.Task] = set()
+
+    async def insert(self, document: dict) -> ObjectId:
+        """Queue `document` for the next batch and wait until it is written."""
+        loop = asyncio.get_running_loop()
+        # Client-side _id so each caller knows its id whatever happens to the batch
+        document.setdefault("_id", ObjectId())
+        future = loop.create_future()
+        self._pending.append((document, future))
+        if len(self._pending) >= self.max_docs:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        await future
+        return document["_id"]
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._write(batch))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: List[Tuple[dict, asyncio.Future]]):
+        self.batches += 1
+        self.documents += len(batch)
+        failed = {}
+        try:
+            await self._get_collection().insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            # ordered=False: everything not listed in writeErrors was inserted
+            failed = {err["index"]: err for err in e.details.get("writeErrors", [])}
+        except Exception as e:
+            logger.error("Group commit of %d documents failed: %s", len(batch), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for index, (doc, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                err = failed[index]
+                # Same exception type insert_one would raise, so callers can handle duplicates alike
+                error_type = DuplicateKeyError if err.get("code") == 11000 else WriteError
+                future.set_exception(error_type(err.get("errmsg", "Write failed"), err.get("code"), err))
+            else:
+                future.set_result(doc["_id"])
+
+    async def close(self):
+        """Write whatever is still waiting and wait for in-flight batches."""
+        self._flush()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "documents": self.documents,
+            "avg_batch_size": round(self.documents / self.batches, 2) if self.batches else 0.0,
+            "pending": len(self._pending),
+        }
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import logging
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.db.mongo import get_database
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_POLL_MIN_SEC = 0.05
+_POLL_MAX_SEC = 1.0
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was first used for a different request."""
+
+
+class IdempotencyInProgress(Exception):
+    """The first request with this key is still running after IDEMPOTENCY_WAIT_SEC."""
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """Stable hash of the request fields a key is bound to."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def _collection():
+    return get_database()[settings.MONGO_DB_IDEMPOTENCY]
+
+
+async def _try_insert(key: str, fingerprint: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        await _collection().insert_one({
+            "_id": key,
+            "fingerprint": fingerprint,
+            "state": "in_progress",
+            "createdAt": now,
+            "lockedUntil": now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SEC),
+        })
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def _try_take_over(key: str) -> bool:
+    """
+    Claim a key whose owner stopped renewing its lock. A running request renews
+    it through keep_claimed(), so this only happens when its worker died.
+    """
+    now = datetime.now(timezone.utc)
+    doc = await _collection().find_one_and_update(
+        {"_id": key, "state": "in_progress", "lockedUntil": {"$lte": now}},
+        {"$set": {"lockedUntil": now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SEC)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc is not None
+
+
+async def claim(key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    """
+    Claim an idempotency key before doing the work
+
+    Concurrent duplicates poll until the first request completes (or gives the
+    key back), so at most one execution runs per key.
+
+    Args:
+        key: Idempotency key, already scoped to the caller
+        fingerprint: request_fingerprint() of the request fields
+
+    Returns:
+        None if the caller now owns the key and must run the request and then call
+        complete() or release(); otherwise the stored {"statusCode", "body"} to replay
+
+    Raises:
+        IdempotencyKeyReused: If the key belongs to a request with other fields
+        IdempotencyInProgress: If the first request is still running after IDEMPOTENCY_WAIT_SEC
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.IDEMPOTENCY_WAIT_SEC
+    delay = _POLL_MIN_SEC
+    while True:
+        if await _try_insert(key, fingerprint):
+            return None
+
+        doc = await _collection().find_one({"_id": key})
+        if doc is None:
+            # Released or expired between our insert and read: try again right away
+            continue
+        if doc["fingerprint"] != fingerprint:
+            raise IdempotencyKeyReused(key)
+        if doc["state"] == "completed":
+            return {"statusCode": doc["statusCode"], "body": doc["body"]}
+        if await _try_take_over(key):
+            logger.warning("Took over abandoned idempotency key %s", key)
+            return None
+
+        if loop.time() >= deadline:
+            raise IdempotencyInProgress(key)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, _POLL_MAX_SEC)
+
+
+async def _renew_lock(key: str):
+    interval = settings.IDEMPOTENCY_LOCK_SEC / 3
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await _collection().update_one(
+                {"_id": key, "state": "in_progress"},
+                {"$set": {"lockedUntil": datetime.now(timezone.utc) + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SEC)}},
+            )
+        except Exception as e:
+            logger.warning("Could not renew idempotency lock %s: %s", key, e)
+
+
+@asynccontextmanager
+async def keep_claimed(key: str):
+    """
+    Renew the lock of a claimed key every IDEMPOTENCY_LOCK_SEC / 3 while the
+    request runs, so a slow request is never taken over and run twice.
+    """
+    heartbeat = asyncio.create_task(_renew_lock(key))
+    try:
+        yield
+    finally:
+        heartbeat.cancel()
+        with suppress(asyncio.CancelledError):
+            await heartbeat
+
+
+async def complete(key: str, status_code: int, body: Dict[str, Any]):
+    """Store the response so later duplicates are replayed; expires with the TTL index."""
+    await _collection().update_one(
+        {"_id": key},
+        {"$set": {
+            "state": "completed",
+            "statusCode": status_code,
+            "body": body,
+            "completedAt": datetime.now(timezone.utc),
+        }, "$unset": {"lockedUntil": ""}},
+    )
+
+
+async def release(key: str):
+    """Give the key back after a failure so a retry runs the request again."""
+    await _collection().delete_one({"_id": key, "state": "in_progress"})
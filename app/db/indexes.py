@@ -0,0 +1,141 @@
+import logging
+from typing import Any, Dict, List
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from app.db.mongo import get_database
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Declarative index set for the slips collection; anything missing is built at startup.
+# background=True only matters on MongoDB < 4.2; newer servers never hold the collection lock.
+SLIP_INDEXES: List[IndexModel] = [
+    # Organizer views: whole market, or one reservation within a market
+    IndexModel([("marketID", ASCENDING), ("vendorReservationID", ASCENDING)], name="marketID_vendorReservationID", background=True),
+    # Market-wide bulk listing, paged on _id
+    IndexModel([("marketID", ASCENDING), ("_id", ASCENDING)], name="marketID__id", background=True),
+    # Per-reservation listing and its keyset pagination (filter on vendorReservationID, sort/range on _id);
+    # the marketID-first compound index cannot serve these
+    IndexModel([("vendorReservationID", ASCENDING), ("_id", ASCENDING)], name="vendorReservationID__id", background=True),
+    # One record per object: a retried /complete hits this instead of inserting a second slip
+    IndexModel([("slipKey", ASCENDING)], name="slipKey_unique", unique=True, background=True),
+    # Duplicate-upload detection; slips created before content hashing have no contentHash
+    IndexModel(
+        [("vendorReservationID", ASCENDING), ("contentHash", ASCENDING)],
+        name="vendorReservationID_contentHash",
+        unique=True,
+        partialFilterExpression={"contentHash": {"$exists": True}},
+        background=True,
+    ),
+]
+
+# Outbox relay: due pending events in _id order, held-back lookups per reservation,
+# and expiry of published events
+OUTBOX_INDEXES: List[IndexModel] = [
+    IndexModel([("state", ASCENDING), ("_id", ASCENDING)], name="state__id", background=True),
+    IndexModel([("reservationId", ASCENDING), ("state", ASCENDING)], name="reservationId_state", background=True),
+    IndexModel(
+        [("sentAt", ASCENDING)],
+        name="sentAt_ttl",
+        expireAfterSeconds=settings.OUTBOX_RETENTION_SEC,
+        background=True,
+    ),
+]
+
+
+# Idempotency keys (the key is the _id) expire IDEMPOTENCY_TTL_SEC after first use
+IDEMPOTENCY_INDEXES: List[IndexModel] = [
+    IndexModel(
+        [("createdAt", ASCENDING)],
+        name="createdAt_ttl",
+        expireAfterSeconds=settings.IDEMPOTENCY_TTL_SEC,
+        background=True,
+    ),
+]
+
+
+# Indexes replaced by a declared one; dropped once the replacement exists
+SUPERSEDED_INDEXES: Dict[str, List[str]] = {
+    settings.MONGO_DB_SLIP: ["slipKey"],
+}
+
+
+def _declared_indexes() -> Dict[str, List[IndexModel]]:
+    return {
+        settings.MONGO_DB_SLIP: SLIP_INDEXES,
+        settings.MONGO_DB_OUTBOX: OUTBOX_INDEXES,
+        settings.MONGO_DB_IDEMPOTENCY: IDEMPOTENCY_INDEXES,
+    }
+
+
+# Hot query shapes checked with explain(); values only need the right type
+HOT_QUERIES: Dict[str, Dict[str, Any]] = {
+    "slips_by_reservation": {"vendorReservationID": "_"},
+    "slips_by_market": {"marketID": "_"},
+    "slips_by_market_and_reservation": {"marketID": "_", "vendorReservationID": "_"},
+    "slip_by_key": {"slipKey": "_"},
+    "slip_by_content_hash": {"vendorReservationID": "_", "contentHash": "_"},
+    # Retention sweep: _id range below the cutoff ObjectId
+    "expired_slips": {"_id": {"$lt": ObjectId()}},
+}
+
+
+async def ensure_indexes() -> List[str]:
+    """
+    Build any declared index that does not exist yet
+
+    Returns:
+        Names of the indexes that were created
+    """
+    db = get_database()
+    created: List[str] = []
+    for collection_name, models in _declared_indexes().items():
+        collection = db[collection_name]
+        existing = set()
+        async for index in collection.list_indexes():
+            existing.add(index["name"])
+
+        missing = [model for model in models if model.document["name"] not in existing]
+        if missing:
+            names = await collection.create_indexes(missing)
+            logger.info("Created %s indexes: %s", collection_name, ", ".join(names))
+            created.extend(names)
+        else:
+            logger.info("All %d %s indexes present", len(models), collection_name)
+
+        # Only reached when every declared index exists, so nothing is left unindexed
+        for name in SUPERSEDED_INDEXES.get(collection_name, []):
+            if name in existing:
+                await collection.drop_index(name)
+                logger.info("Dropped superseded %s index %s", collection_name, name)
+    return created
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """Flatten the stage names of an explain() winning plan."""
+    stages = [plan.get("stage", "")]
+    for child_key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(child_key), dict):
+            stages.extend(_plan_stages(plan[child_key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+async def verify_query_plans() -> Dict[str, List[str]]:
+    """
+    Run explain() on the hot queries and warn on collection scans
+
+    Returns:
+        Mapping of query name -> winning plan stages
+    """
+    slip_collection = get_database()[settings.MONGO_DB_SLIP]
+    plans = {}
+    for name, query in HOT_QUERIES.items():
+        explanation = await slip_collection.find(query).explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(winning_plan)
+        plans[name] = stages
+        if "COLLSCAN" in stages:
+            logger.warning("Query %s uses a COLLSCAN: %s", name, query)
+    return plans
@@ -0,0 +1,100 @@
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.utils.cache import SingleFlight
+
+# Identifies this process as a lease holder
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class MongoLease:
+    """
+    A named lease document in Mongo: held by one process (across workers and
+    CLI runs) at a time, and taken over by another once it expires unrenewed.
+
+    The lease document may carry other state of its holder (e.g. a checkpoint);
+    renew() can write it in the same update.
+
+    Args:
+        get_collection: Returns the Motor collection holding the lease document
+        lease_id: _id of the lease document
+        duration_sec: How long an acquire or renew keeps the lease
+    """
+
+    def __init__(self, get_collection: Callable[[], Any], lease_id: str, duration_sec: float):
+        self._get_collection = get_collection
+        self.lease_id = lease_id
+        self.duration = duration_sec
+        self.held = False
+        self._renewed_at = 0.0
+        self._renewals = SingleFlight()
+
+    def _expires_at(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=self.duration)
+
+    async def acquire(self) -> Optional[dict]:
+        """
+        Take the lease if it is free or expired, or renew it if we hold it
+
+        Returns:
+            The lease document, or None if another process holds the lease
+        """
+        renewed_at = time.monotonic()
+        try:
+            document = await self._get_collection().find_one_and_update(
+                {"_id": self.lease_id, "$or": [{"owner": OWNER}, {"expiresAt": {"$lte": datetime.now(timezone.utc)}}]},
+                {"$set": {"owner": OWNER, "expiresAt": self._expires_at()}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Another process holds an unexpired lease
+            self.held = False
+            return None
+        self.held = True
+        self._renewed_at = renewed_at
+        return document
+
+    async def renew(self, update: Optional[Dict[str, Any]] = None, inc: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Extend the lease, writing `update` ($set) and `inc` ($inc) along with it
+
+        Returns:
+            False if the lease was lost to another process (nothing is written then)
+        """
+        renewed_at = time.monotonic()
+        change: Dict[str, Any] = {"$set": {**(update or {}), "expiresAt": self._expires_at()}}
+        if inc:
+            change["$inc"] = inc
+        result = await self._get_collection().update_one({"_id": self.lease_id, "owner": OWNER}, change)
+        self.held = result.matched_count == 1
+        if self.held:
+            self._renewed_at = renewed_at
+        return self.held
+
+    async def ensure(self, min_remaining_sec: float) -> bool:
+        """
+        Renew the lease unless it is still good for at least `min_remaining_sec`
+        (call before each unit of work that must finish under the lease)
+
+        Returns:
+            False if the lease is lost
+        """
+        if not self.held:
+            return False
+        if self.duration - (time.monotonic() - self._renewed_at) >= min_remaining_sec:
+            return True
+        # Concurrent callers share one renewal
+        return await self._renewals.do("renew", self.renew)
+
+    async def release(self):
+        """Expire our lease so another process takes over without waiting it out."""
+        await self._get_collection().update_one(
+            {"_id": self.lease_id, "owner": OWNER},
+            {"$set": {"expiresAt": datetime.now(timezone.utc)}},
+        )
+        self.held = False
@@ -38,6 +38,13 @@ def get_database():
     return _database
 
 
+def get_client():
+    """Return the Motor client (needed for sessions/transactions)."""
+    if _mongo_client is None:
+        raise RuntimeError("Database not initialized. Call connect_to_mongo() first.")
+    return _mongo_client
+
+
 def close_mongo_connection():
     """Close the MongoDB connection pool."""
     global _mongo_client
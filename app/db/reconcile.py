@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, AsyncIterator, Dict, IO, List, Optional, Tuple
+from bson import ObjectId
+from app.db.mongo import get_database
+from app.core.config import settings
+from app.core.image_processing import THUMBNAIL_PREFIX
+from app.crud import delete_slips
+from app.utils.s3 import DELETE_OBJECTS_MAX_KEYS, delete_objects, list_objects_page
+
+logger = logging.getLogger(__name__)
+
+# Keys are "<reservation id>/<hash>.<ext>" or "<uuid4>_...": both start with a hex digit
+_HEX_DIGITS = "0123456789abcdef"
+# Key shapes this service writes: "<reservation id>/<sha256><.ext>" (content-addressed
+# uploads) and "<uuid4>_<timestamp>_<filename>" (upload intents and older uploads),
+# either one optionally behind THUMBNAIL_PREFIX. Anything else in the bucket belongs
+# to someone else and is never reported or deleted.
+_SLIP_KEY_PATTERN = re.compile(
+    rf"^(?:{re.escape(THUMBNAIL_PREFIX)})?"
+    r"(?:[^/]+/[0-9a-f]{64}(?:\.[^/]*)?"
+    r"|[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}_.+)$"
+)
+# Orphans kept per partition for the summary; the full list goes to the report file
+_SAMPLE_SIZE = 20
+
+
+def is_slip_object_key(key: str) -> bool:
+    """True if `key` has the shape of a slip image or thumbnail written by this service."""
+    return _SLIP_KEY_PATTERN.match(key) is not None
+
+
+@dataclass
+class PartitionResult:
+    lower: Optional[str]
+    upper: Optional[str]
+    s3_objects: int = 0
+    foreign_objects: int = 0
+    records: int = 0
+    orphan_objects: int = 0
+    missing_objects: int = 0
+    missing_thumbnails: int = 0
+    deleted_objects: int = 0
+    deleted_records: int = 0
+    samples: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def partition_bounds(partitions: int) -> List[Optional[str]]:
+    """
+    Split the key space into `partitions` ranges on the leading hex digit
+
+    Partition i covers keys k with bounds[i] < k <= bounds[i + 1] (None = open),
+    which maps exactly onto ListObjectsV2 StartAfter (exclusive) and a Mongo
+    {"$gt", "$lte"} range. Keys outside the hex digits still land in the
+    first or last partition.
+    """
+    partitions = max(1, min(partitions, len(_HEX_DIGITS)))
+    inner = [_HEX_DIGITS[(len(_HEX_DIGITS) * i) // partitions] for i in range(1, partitions)]
+    return [None, *inner, None]
+
+
+async def _s3_objects(
+    lower: Optional[str],
+    upper: Optional[str],
+    prefix: str = "",
+    skip_prefix: Optional[str] = None,
+) -> AsyncIterator[Tuple[str, datetime]]:
+    """
+    Stream (key, LastModified) for prefix+lower < key <= prefix+upper, a page at a time
+
+    Keys under `skip_prefix` are jumped over with a fresh listing instead of
+    being paged through.
+    """
+    loop = asyncio.get_running_loop()
+    start_after = prefix + lower if lower is not None else None
+    stop_after = prefix + upper if upper is not None else None
+    token = None
+    skipped = False
+    while True:
+        page = await loop.run_in_executor(None, partial(list_objects_page, prefix, start_after, token))
+        restart = False
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if stop_after is not None and key > stop_after:
+                return
+            if skip_prefix and key.startswith(skip_prefix):
+                if not skipped:
+                    # U+FFFF sorts after every character S3 keys realistically contain
+                    start_after, token, skipped, restart = skip_prefix + "\uffff", None, True, True
+                    break
+                continue
+            yield key, obj["LastModified"]
+        if restart:
+            continue
+        if not page.get("IsTruncated"):
+            return
+        token = page["NextContinuationToken"]
+
+
+async def _slip_records(
+    lower: Optional[str],
+    upper: Optional[str],
+    thumbnails: bool = False,
+) -> AsyncIterator[Tuple[str, ObjectId]]:
+    """
+    Stream (key, slip _id) in slipKey order for lower < slipKey <= upper (slipKey index)
+
+    With `thumbnails`, yields thumbKey instead, for slips that have one; a
+    thumbnail key is its slip key behind a fixed prefix, so the order holds.
+    """
+    key_range: Dict[str, str] = {}
+    if lower is not None:
+        key_range["$gt"] = lower
+    if upper is not None:
+        key_range["$lte"] = upper
+    query: Dict[str, Any] = {"slipKey": key_range} if key_range else {"slipKey": {"$exists": True}}
+    if thumbnails:
+        query["thumbKey"] = {"$type": "string"}
+    cursor = (
+        get_database()[settings.MONGO_DB_SLIP]
+        .find(query, {"slipKey": 1, "thumbKey": 1})
+        .sort("slipKey", 1)
+        .batch_size(1000)
+    )
+    async for slip in cursor:
+        yield (slip["thumbKey"] if thumbnails else slip["slipKey"]), slip["_id"]
+
+
+async def _next(iterator: AsyncIterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class _Reconciler:
+    """Holds the options and shared report file of one reconcile run."""
+
+    def __init__(self, delete_orphans: bool, delete_records: bool, report: Optional[IO[str]]):
+        self.delete_orphans = delete_orphans
+        self.delete_records = delete_records
+        self.report = report
+        self.grace_cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.RECONCILE_GRACE_SEC)
+        self.loop = asyncio.get_running_loop()
+
+    def _record(self, result: PartitionResult, kind: str, key: str, slip_id: Optional[ObjectId] = None):
+        entry = {"type": kind, "key": key}
+        if slip_id is not None:
+            entry["slipId"] = str(slip_id)
+        if len(result.samples) < _SAMPLE_SIZE:
+            result.samples.append(entry)
+        if self.report is not None:
+            self.report.write(json.dumps(entry) + "\n")
+
+    async def _flush_objects(self, result: PartitionResult, keys: List[str]):
+        if not self.delete_orphans or not keys:
+            keys.clear()
+            return
+        failed = await self.loop.run_in_executor(None, delete_objects, list(keys))
+        result.deleted_objects += len(keys) - len(failed)
+        keys.clear()
+
+    async def _flush_records(self, result: PartitionResult, slip_ids: List[ObjectId]):
+        if not self.delete_records or not slip_ids:
+            slip_ids.clear()
+            return
+        result.deleted_records += await delete_slips(list(slip_ids))
+        slip_ids.clear()
+
+    async def run_partition(self, result: PartitionResult, thumbnails: bool):
+        if thumbnails:
+            objects = _s3_objects(result.lower, result.upper, prefix=THUMBNAIL_PREFIX)
+        else:
+            objects = _s3_objects(result.lower, result.upper, skip_prefix=THUMBNAIL_PREFIX)
+        records = _slip_records(result.lower, result.upper, thumbnails=thumbnails)
+        await self.merge_join(result, objects, records, thumbnails)
+
+    async def merge_join(
+        self,
+        result: PartitionResult,
+        objects: AsyncIterator[Tuple[str, datetime]],
+        records: AsyncIterator[Tuple[str, ObjectId]],
+        thumbnails: bool = False,
+    ):
+        """
+        Walk the S3 listing and the Mongo cursor side by side; both are sorted by
+        key, so each side is read once and only the current item of each is held.
+
+        Objects whose key does not have a slip key shape still match records (so
+        such records are not reported missing) but are never orphans.
+        """
+        orphan_keys: List[str] = []
+        orphan_slips: List[ObjectId] = []
+
+        obj = await _next(objects)
+        rec = await _next(records)
+        matched_key = None
+        while obj is not None or rec is not None:
+            if rec is not None and rec[0] == matched_key:
+                # Several records sharing one object: already matched
+                result.records += 1
+                rec = await _next(records)
+            elif rec is None or (obj is not None and obj[0] < rec[0]):
+                key, last_modified = obj
+                result.s3_objects += 1
+                if not is_slip_object_key(key):
+                    result.foreign_objects += 1
+                elif last_modified < self.grace_cutoff:
+                    result.orphan_objects += 1
+                    self._record(result, "orphan_object", key)
+                    orphan_keys.append(key)
+                    if len(orphan_keys) >= DELETE_OBJECTS_MAX_KEYS:
+                        await self._flush_objects(result, orphan_keys)
+                obj = await _next(objects)
+            elif obj is None or rec[0] < obj[0]:
+                key, slip_id = rec
+                result.records += 1
+                if slip_id.generation_time < self.grace_cutoff:
+                    if thumbnails:
+                        # The slip image may still be there; only report
+                        result.missing_thumbnails += 1
+                        self._record(result, "missing_thumbnail", key, slip_id)
+                    else:
+                        result.missing_objects += 1
+                        self._record(result, "missing_object", key, slip_id)
+                        orphan_slips.append(slip_id)
+                        if len(orphan_slips) >= DELETE_OBJECTS_MAX_KEYS:
+                            await self._flush_records(result, orphan_slips)
+                rec = await _next(records)
+            else:
+                matched_key = obj[0]
+                result.s3_objects += 1
+                result.records += 1
+                obj = await _next(objects)
+                rec = await _next(records)
+
+        await self._flush_objects(result, orphan_keys)
+        await self._flush_records(result, orphan_slips)
+
+
+async def reconcile(
+    delete_orphans: bool = False,
+    delete_records: bool = False,
+    partitions: Optional[int] = None,
+    report: Optional[IO[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Find S3 objects without a slip record and slip records without an S3 object
+
+    Each key range is reconciled by a merge join of a ListObjectsV2 listing and
+    a slipKey-ordered cursor, in constant memory; ranges run in parallel
+    (RECONCILE_CONCURRENCY at a time), slip images and thumbnails separately.
+    Anything younger than RECONCILE_GRACE_SEC is ignored, since uploads land
+    in S3 before their record is written, and so is every key that does not
+    have the shape of a key this service writes. By default nothing is deleted.
+
+    Args:
+        delete_orphans: Delete orphan S3 objects (DeleteObjects batches)
+        delete_records: Delete slip records whose image is missing
+        partitions: Number of key ranges (default: RECONCILE_PARTITIONS)
+        report: Text file receiving one JSON line per orphan
+
+    Returns:
+        Totals over all partitions, with a sample of orphans
+    """
+    reconciler = _Reconciler(delete_orphans, delete_records, report)
+    bounds = partition_bounds(partitions or settings.RECONCILE_PARTITIONS)
+    semaphore = asyncio.Semaphore(settings.RECONCILE_CONCURRENCY)
+
+    async def run(result: PartitionResult, thumbnails: bool) -> PartitionResult:
+        async with semaphore:
+            await reconciler.run_partition(result, thumbnails)
+            logger.info(
+                "Reconciled %s (%s, %s]: %d objects, %d records, %d orphan objects, %d missing",
+                "thumbnails" if thumbnails else "slips", result.lower, result.upper,
+                result.s3_objects, result.records, result.orphan_objects,
+                result.missing_objects + result.missing_thumbnails,
+            )
+            return result
+
+    jobs = [
+        run(PartitionResult(lower, upper), thumbnails)
+        for thumbnails in (False, True)
+        for lower, upper in zip(bounds, bounds[1:])
+    ]
+    results = await asyncio.gather(*jobs)
+
+    summary: Dict[str, Any] = {
+        "delete_orphans": delete_orphans,
+        "delete_records": delete_records,
+        "partitions": len(bounds) - 1,
+    }
+    for name in (
+        "s3_objects", "foreign_objects", "records", "orphan_objects", "missing_objects",
+        "missing_thumbnails", "deleted_objects", "deleted_records",
+    ):
+        summary[name] = sum(getattr(result, name) for result in results)
+    summary["samples"] = [sample for result in results for sample in result.samples][:_SAMPLE_SIZE]
+    return summary
@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.db.lease import OWNER, MongoLease
+from app.db.mongo import get_database
+from app.core.config import settings
+from app.crud import delete_slips
+from app.utils.admission import get_limiter
+from app.utils.metrics import CallbackMetric, mongo_request_seconds
+from app.utils.s3 import delete_objects
+
+logger = logging.getLogger(__name__)
+
+# Single document holding both the lease and the checkpoint of the current run
+_STATE_ID = "sweeper"
+
+_sweep_task: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+_stopping = False
+
+_stats: Dict[str, Any] = {
+    "runs": 0,
+    "scanned": 0,
+    "deleted_slips": 0,
+    "deleted_objects": 0,
+    "failed_objects": 0,
+    "last_run_at": None,
+    "leader": False,
+}
+
+
+CallbackMetric(
+    "slip_retention_deleted_total",
+    "Slip records and S3 objects removed by the retention sweeper",
+    ["kind"],
+    lambda: [(("slips",), _stats["deleted_slips"]), (("objects",), _stats["deleted_objects"])],
+    kind="counter",
+)
+CallbackMetric(
+    "slip_retention_failed_objects_total",
+    "S3 objects the retention sweeper could not delete (their slips are kept for the next run)",
+    [],
+    lambda: [((), _stats["failed_objects"])],
+    kind="counter",
+)
+
+
+def get_retention_stats() -> Dict[str, Any]:
+    return dict(_stats)
+
+
+def _retention_statuses() -> List[str]:
+    return [status.strip() for status in settings.SLIP_RETENTION_STATUSES.split(",") if status.strip()]
+
+
+def _state_collection():
+    return get_database()[settings.MONGO_DB_RETENTION]
+
+
+# Only one sweeper across all workers (and CLI runs) at a time; the lease is
+# renewed with every checkpoint
+_lease = MongoLease(_state_collection, _STATE_ID, settings.SLIP_RETENTION_LEASE_SEC)
+
+
+def _start_after(state: dict, now: datetime) -> Optional[ObjectId]:
+    """
+    Where a new run starts: after `sweptBelow`, the cutoff of the last finished
+    run, since everything below it was already walked. Without retention
+    statuses that range holds nothing left to delete. With them, slips kept
+    there can still be retired later, so a run starts from the beginning again
+    once the last full pass is SLIP_RETENTION_RESCAN_DAYS old.
+    """
+    swept_below = state.get("sweptBelow")
+    if swept_below is None or not _retention_statuses():
+        return swept_below
+    full_scan_at = state.get("fullScanAt")
+    if full_scan_at is None or full_scan_at.replace(tzinfo=timezone.utc) <= now - timedelta(days=settings.SLIP_RETENTION_RESCAN_DAYS):
+        return None
+    return swept_below
+
+
+async def _begin_run(state: dict) -> dict:
+    """Resume an unfinished run from its checkpoint, or start a new one with a fresh cutoff."""
+    if state.get("cutoff") is not None and state.get("finishedAt") is None:
+        logger.info("Resuming retention sweep after %s", state.get("lastId"))
+        return state
+    now = datetime.now(timezone.utc)
+    start_after = _start_after(state, now)
+    update = {
+        "cutoff": now - timedelta(days=settings.SLIP_RETENTION_DAYS),
+        "lastId": start_after,
+        "startedAt": now,
+        "finishedAt": None,
+        "deletedSlips": 0,
+        "deletedObjects": 0,
+    }
+    if start_after is None:
+        update["fullScanAt"] = now
+    return await _state_collection().find_one_and_update(
+        {"_id": _STATE_ID, "owner": OWNER},
+        {"$set": update},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _checkpoint(update: Dict[str, Any], deleted_slips: int = 0, deleted_objects: int = 0) -> bool:
+    """Record progress and renew the lease in the same write; False if the lease was lost."""
+    return await _lease.renew(update, {"deletedSlips": deleted_slips, "deletedObjects": deleted_objects})
+
+
+async def _select_retired(batch: List[dict], statuses: List[str]) -> List[dict]:
+    """Keep only slips whose reservation has one of the retention statuses in the reservation index."""
+    if not statuses:
+        return batch
+    reservation_ids = list({slip.get("vendorReservationID") for slip in batch if slip.get("vendorReservationID")})
+    collection = get_database()[settings.MONGO_DB_RESERVATION_INDEX]
+    with mongo_request_seconds.time(operation="find_retired_reservations"):
+        retired = {
+            doc["_id"]
+            async for doc in collection.find({"_id": {"$in": reservation_ids}, "status": {"$in": statuses}}, {"_id": 1})
+        }
+    return [slip for slip in batch if slip.get("vendorReservationID") in retired]
+
+
+def _object_keys(slip: dict) -> List[str]:
+    return [key for key in (slip.get("slipKey"), slip.get("thumbKey")) if key]
+
+
+async def _yield_to_traffic(batch_started: float, slips_in_batch: int):
+    """
+    Keep the sweep under SLIP_RETENTION_MAX_SLIPS_PER_SEC scanned (whether or
+    not they turn out to be deletable), and hold off
+    entirely while uploads are queueing for admission in this worker.
+    """
+    min_duration = slips_in_batch / settings.SLIP_RETENTION_MAX_SLIPS_PER_SEC
+    remaining = min_duration - (time.monotonic() - batch_started)
+    if remaining > 0:
+        await asyncio.sleep(remaining)
+    upload_limiter = get_limiter("upload")
+    while upload_limiter.waiting > 0 and not _stopping:
+        await asyncio.sleep(1)
+
+
+async def sweep_retention(dry_run: bool = False, max_batches: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run (or resume) one retention pass over the slips collection
+
+    Slips are walked in _id order below the ObjectId of the cutoff time, so the
+    range is served by the _id index and the last _id is a complete checkpoint.
+    (Slips carry no creation date of their own; the ObjectId timestamp is it.)
+    Each batch deletes its S3 objects first, then the records whose objects are
+    all gone; a crash in between only repeats idempotent deletes on resume.
+
+    Args:
+        dry_run: Count what would be deleted without deleting or checkpointing
+        max_batches: Stop after this many batches (the run resumes next time)
+
+    Returns:
+        Summary of the pass
+    """
+    if dry_run:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=settings.SLIP_RETENTION_DAYS)
+        last_id = None
+    else:
+        state = await _lease.acquire()
+        _stats["leader"] = state is not None
+        if state is None:
+            return {"skipped": True, "reason": "another process holds the retention lease"}
+        state = await _begin_run(state)
+        cutoff = state["cutoff"].replace(tzinfo=timezone.utc)
+        last_id = state.get("lastId")
+
+    slip_collection = get_database()[settings.MONGO_DB_SLIP]
+    statuses = _retention_statuses()
+    cutoff_id = ObjectId.from_datetime(cutoff)
+    loop = asyncio.get_running_loop()
+    summary = {
+        "dry_run": dry_run,
+        "cutoff": cutoff.isoformat(),
+        "scanned": 0,
+        "expired": 0,
+        "deleted_slips": 0,
+        "deleted_objects": 0,
+        "failed_objects": 0,
+        "finished": False,
+    }
+
+    batches = 0
+    while not _stopping and (max_batches is None or batches < max_batches):
+        batch_started = time.monotonic()
+        id_range: Dict[str, Any] = {"$lt": cutoff_id}
+        if last_id is not None:
+            id_range["$gt"] = last_id
+        cursor = (
+            slip_collection.find({"_id": id_range}, {"slipKey": 1, "thumbKey": 1, "vendorReservationID": 1})
+            .sort("_id", 1)
+            .limit(settings.SLIP_RETENTION_BATCH_SIZE)
+        )
+        with mongo_request_seconds.time(operation="find_expired_slips"):
+            batch = [slip async for slip in cursor]
+        if not batch:
+            summary["finished"] = True
+            if not dry_run:
+                await _checkpoint({"finishedAt": datetime.now(timezone.utc), "sweptBelow": cutoff_id})
+            break
+
+        expired = await _select_retired(batch, statuses)
+        keys = [key for slip in expired for key in _object_keys(slip)]
+        summary["scanned"] += len(batch)
+        summary["expired"] += len(expired)
+        last_id = batch[-1]["_id"]
+        batches += 1
+
+        if dry_run:
+            summary["deleted_slips"] += len(expired)
+            summary["deleted_objects"] += len(keys)
+            await _yield_to_traffic(batch_started, len(batch))
+            continue
+
+        # Off the upload executor: the sweep never takes threads from live uploads
+        failed = await loop.run_in_executor(None, delete_objects, keys) if keys else {}
+        removable = [slip["_id"] for slip in expired if not any(key in failed for key in _object_keys(slip))]
+        deleted_slips = await delete_slips(removable)
+        deleted_objects = len(keys) - len(failed)
+        if failed:
+            logger.warning("Retention sweep could not delete %d objects, e.g. %s", len(failed), next(iter(failed.items())))
+
+        held = await _checkpoint({"lastId": last_id}, deleted_slips, deleted_objects)
+        summary["deleted_slips"] += deleted_slips
+        summary["deleted_objects"] += deleted_objects
+        summary["failed_objects"] += len(failed)
+        _stats["scanned"] += len(batch)
+        _stats["deleted_slips"] += deleted_slips
+        _stats["deleted_objects"] += deleted_objects
+        _stats["failed_objects"] += len(failed)
+        if not held:
+            # Another process took over after our lease expired; it resumes from its own checkpoint
+            logger.warning("Retention lease lost after %s, stopping this run", last_id)
+            _stats["leader"] = False
+            break
+
+        await _yield_to_traffic(batch_started, len(batch))
+
+    if not dry_run:
+        _stats["runs"] += 1
+        _stats["last_run_at"] = datetime.now(timezone.utc).isoformat()
+    return summary
+
+
+async def _sweep_loop():
+    while not _stopping:
+        _wakeup.clear()
+        try:
+            summary = await sweep_retention()
+            if not summary.get("skipped"):
+                logger.info("Retention sweep: %s", summary)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Retention sweep failed: %s", e)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.SLIP_RETENTION_INTERVAL_SEC)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_retention_sweeper():
+    """Start the periodic background sweep (call from the app lifespan)."""
+    global _sweep_task, _wakeup, _stopping
+    if _sweep_task is None or _sweep_task.done():
+        _stopping = False
+        _wakeup = asyncio.Event()
+        _sweep_task = asyncio.create_task(_sweep_loop())
+
+
+async def stop_retention_sweeper(timeout: float = 10):
+    """
+    Stop after the batch in progress; its checkpoint is written, so the next
+    run (on any worker) resumes right after it.
+    """
+    global _sweep_task, _stopping
+    if _sweep_task is not None:
+        _stopping = True
+        _wakeup.set()
+        try:
+            await asyncio.wait_for(_sweep_task, timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        _sweep_task = None
+    # Also reached after a CLI pass, which holds the lease without a task
+    if _stats["leader"]:
+        try:
+            await _lease.release()
+        except Exception as e:
+            logger.warning("Could not release retention lease: %s", e)
+        _stats["leader"] = False
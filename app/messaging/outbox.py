@@ -0,0 +1,210 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from app.db.lease import MongoLease
+from app.db.mongo import get_database
+from app.core.config import settings
+from app.messaging.rabbitmq import update_reservation_statuses
+from app.utils.metrics import CallbackMetric, retries_total
+
+logger = logging.getLogger(__name__)
+
+_relay_task: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+_stopping = False
+
+_stats: Dict[str, Any] = {
+    "published": 0,
+    "failed_attempts": 0,
+    "dead_lettered": 0,
+    "lag_sec": 0.0,
+    "max_lag_sec": 0.0,
+    "leader": False,
+}
+
+
+CallbackMetric("slip_outbox_lag_seconds", "Age of the oldest due outbox event at the last drain", [], lambda: [((), _stats["lag_sec"])])
+CallbackMetric("slip_outbox_max_lag_seconds", "Largest outbox lag seen by this worker", [], lambda: [((), _stats["max_lag_sec"])])
+CallbackMetric("slip_outbox_published_total", "Outbox events published", [], lambda: [((), _stats["published"])], kind="counter")
+CallbackMetric("slip_outbox_dead_lettered_total", "Outbox events given up on", [], lambda: [((), _stats["dead_lettered"])], kind="counter")
+CallbackMetric("slip_outbox_leader", "1 if this worker holds the relay lease", [], lambda: [((), int(_stats["leader"]))])
+
+
+def notify_outbox():
+    """Wake the relay right away instead of waiting for the next poll."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def get_outbox_stats() -> Dict[str, Any]:
+    return dict(_stats)
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(2 ** attempts, 60))
+
+
+# Only one relay across all workers drains the outbox; the lease is taken (or
+# renewed) every cycle and again before any publish it might not outlast
+_lease = MongoLease(
+    lambda: get_database()[f"{settings.MONGO_DB_OUTBOX}_lease"],
+    "relay",
+    settings.OUTBOX_LEASE_SEC,
+)
+
+
+async def _publish_in_rounds(per_reservation: Dict[str, List[dict]]) -> List[tuple]:
+    """
+    Publish each reservation's events oldest first. Round k sends the k-th event
+    of every reservation whose earlier events were all confirmed, as one pipelined
+    batch, so a batch of events costs one confirm round trip per round rather
+    than per event. A reservation stops at its first failure so later events never
+    overtake it, and everything stops as soon as the lease is lost so another
+    relay never publishes the same event alongside us.
+
+    Returns:
+        (event, error_or_None) for each event that was attempted
+    """
+    results = []
+    pending = [events for events in per_reservation.values() if events]
+    while pending:
+        # A round can wait RABBITMQ_CONFIRM_TIMEOUT_SEC for its confirms
+        if not await _lease.ensure(settings.RABBITMQ_CONFIRM_TIMEOUT_SEC + 1):
+            break
+        heads = [events[0] for events in pending]
+        errors = await update_reservation_statuses(heads)
+        next_round = []
+        for events, event, error in zip(pending, heads, errors):
+            results.append((event, error))
+            if error is None and len(events) > 1:
+                next_round.append(events[1:])
+        pending = next_round
+    return results
+
+
+async def drain_outbox_once() -> int:
+    """
+    Publish one batch of pending outbox events
+
+    Returns:
+        Number of events published
+    """
+    outbox_collection = get_database()[settings.MONGO_DB_OUTBOX]
+    now = datetime.now(timezone.utc)
+
+    cursor = (
+        outbox_collection.find({"state": "pending", "nextAttemptAt": {"$lte": now}})
+        .sort("_id", 1)
+        .limit(settings.OUTBOX_BATCH_SIZE)
+    )
+    batch = [event async for event in cursor]
+
+    if batch:
+        oldest = batch[0]["createdAt"].replace(tzinfo=timezone.utc)
+        _stats["lag_sec"] = round((now - oldest).total_seconds(), 3)
+        _stats["max_lag_sec"] = max(_stats["max_lag_sec"], _stats["lag_sec"])
+    else:
+        _stats["lag_sec"] = 0.0
+        return 0
+
+    # An older event of the same reservation that is still backing off must go first:
+    # hold back everything newer than it
+    reservation_ids = list({event["reservationId"] for event in batch})
+    held_after: Dict[str, Any] = {}
+    waiting = outbox_collection.find(
+        {"state": "pending", "reservationId": {"$in": reservation_ids}, "nextAttemptAt": {"$gt": now}},
+        {"reservationId": 1},
+    )
+    async for event in waiting:
+        current = held_after.get(event["reservationId"])
+        if current is None or event["_id"] < current:
+            held_after[event["reservationId"]] = event["_id"]
+
+    per_reservation: Dict[str, List[dict]] = defaultdict(list)
+    for event in batch:
+        held = held_after.get(event["reservationId"])
+        if held is not None and event["_id"] > held:
+            continue
+        per_reservation[event["reservationId"]].append(event)
+
+    sent_ids = []
+    for event, error in await _publish_in_rounds(per_reservation):
+        if error is None:
+            sent_ids.append(event["_id"])
+            continue
+        attempts = event["attempts"] + 1
+        _stats["failed_attempts"] += 1
+        retries_total.inc(downstream="outbox")
+        update = {"attempts": attempts, "lastError": str(error), "nextAttemptAt": now + _backoff(attempts)}
+        if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            update["state"] = "failed"
+            _stats["dead_lettered"] += 1
+            logger.error("Outbox event %s dead-lettered after %d attempts: %s", event["_id"], attempts, error)
+        await outbox_collection.update_one({"_id": event["_id"]}, {"$set": update})
+
+    if sent_ids:
+        await outbox_collection.update_many(
+            {"_id": {"$in": sent_ids}},
+            {"$set": {"state": "sent", "sentAt": datetime.now(timezone.utc)}},
+        )
+        _stats["published"] += len(sent_ids)
+    return len(sent_ids)
+
+
+async def _relay_loop():
+    poll_interval = settings.OUTBOX_POLL_INTERVAL_MS / 1000
+    while not _stopping:
+        _wakeup.clear()
+        published = 0
+        try:
+            _stats["leader"] = await _lease.acquire() is not None
+            if _stats["leader"]:
+                published = await drain_outbox_once()
+                if not _lease.held:
+                    logger.warning("Outbox lease lost during a drain; another relay takes over")
+                    _stats["leader"] = False
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Outbox relay cycle failed: %s", e)
+
+        # A full batch means more is waiting: go again without sleeping
+        if _stopping or published >= settings.OUTBOX_BATCH_SIZE:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_outbox_relay():
+    """Start the background relay (call from the app lifespan)."""
+    global _relay_task, _wakeup, _stopping
+    if _relay_task is None or _relay_task.done():
+        _stopping = False
+        _wakeup = asyncio.Event()
+        _relay_task = asyncio.create_task(_relay_loop())
+
+
+async def stop_outbox_relay(timeout: float = 10):
+    """
+    Stop the relay after its current cycle, so a batch being published is
+    finished and marked sent rather than cut off (cancelled after `timeout`).
+    """
+    global _relay_task, _stopping
+    if _relay_task is not None:
+        _stopping = True
+        notify_outbox()
+        try:
+            await asyncio.wait_for(_relay_task, timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        _relay_task = None
+        if _stats["leader"]:
+            try:
+                await _lease.release()
+            except Exception as e:
+                logger.warning("Could not release outbox lease: %s", e)
+            _stats["leader"] = False
@@ -1,8 +1,11 @@
 import asyncio
 import aio_pika
 import json
-from typing import Dict, Any
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
 from app.core.config import settings
+from app.utils.admission import get_limiter
+from app.utils.metrics import CallbackMetric, broker_publish_seconds
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,6 +13,24 @@ logger = logging.getLogger(__name__)
 # Connection object for reuse
 _connection = None
 
+@dataclass
+class _Publisher:
+    """A long-lived publishing channel and the exchanges already declared on it."""
+    channel: aio_pika.abc.AbstractChannel
+    exchanges: Dict[str, aio_pika.abc.AbstractExchange] = field(default_factory=dict)
+
+# Small pool of confirm-mode channels shared by every publish (round-robin)
+_publishers: List[Optional[_Publisher]] = [None] * settings.RABBITMQ_PUBLISH_CHANNELS
+_publisher_locks = [asyncio.Lock() for _ in range(settings.RABBITMQ_PUBLISH_CHANNELS)]
+_next_publisher = 0
+
+CallbackMetric(
+    "slip_broker_channels_open",
+    "Open pooled publisher-confirm channels",
+    [],
+    lambda: [((), sum(1 for p in _publishers if p is not None and not p.channel.is_closed))],
+)
+
 async def get_rabbitmq_connection():
     """
     Get or establish a connection to RabbitMQ
@@ -24,6 +45,80 @@ async def get_rabbitmq_connection():
             raise
     return _connection
 
+async def _get_exchange(exchange_name: str) -> aio_pika.abc.AbstractExchange:
+    """
+    Return the exchange handle on the next pooled channel, opening the channel
+    or declaring the exchange only the first time (or after a reconnect).
+    """
+    global _next_publisher
+    slot = _next_publisher % len(_publishers)
+    _next_publisher += 1
+
+    async with _publisher_locks[slot]:
+        publisher = _publishers[slot]
+        if publisher is None or publisher.channel.is_closed:
+            connection = await get_rabbitmq_connection()
+            channel = await connection.channel(publisher_confirms=True)
+            publisher = _publishers[slot] = _Publisher(channel=channel)
+
+        exchange = publisher.exchanges.get(exchange_name)
+        if exchange is None:
+            exchange = await publisher.channel.declare_exchange(
+                exchange_name,
+                aio_pika.ExchangeType.TOPIC,
+                durable=True
+            )
+            publisher.exchanges[exchange_name] = exchange
+    return exchange
+
+def _amqp_message(message: Dict[str, Any]) -> aio_pika.Message:
+    return aio_pika.Message(
+        body=json.dumps(message).encode(),
+        content_type="application/json",
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+    )
+
+async def _publish_confirmed(exchange: aio_pika.abc.AbstractExchange, exchange_name: str, routing_key: str, message: Dict[str, Any]):
+    with broker_publish_seconds.time(exchange=exchange_name):
+        await exchange.publish(
+            _amqp_message(message),
+            routing_key=routing_key,
+            timeout=settings.RABBITMQ_CONFIRM_TIMEOUT_SEC
+        )
+
+async def publish_batch(exchange_name: str, routing_key: str, messages: List[Dict[str, Any]]) -> List[Optional[Exception]]:
+    """
+    Publish several messages on one pooled channel and wait for their confirms together
+
+    The messages are written to the channel in list order without waiting for
+    each confirm in between, so the whole batch costs about one broker round
+    trip instead of one per message.
+
+    Args:
+        exchange_name: The name of the exchange
+        routing_key: The routing key for every message
+        messages: The message contents, in publish order
+
+    Returns:
+        None for each confirmed message, or the error it failed with, in list order
+    """
+    if not messages:
+        return []
+    exchange = await _get_exchange(exchange_name)
+    async with get_limiter("broker").slot():
+        # Tasks start in creation order and queue on the channel lock in that order
+        publishes = [
+            asyncio.ensure_future(_publish_confirmed(exchange, exchange_name, routing_key, message))
+            for message in messages
+        ]
+        results = await asyncio.gather(*publishes, return_exceptions=True)
+    errors: List[Optional[Exception]] = []
+    for result in results:
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        errors.append(result if isinstance(result, Exception) else None)
+    return errors
+
 async def send_message(exchange_name: str, routing_key: str, message: Dict[str, Any]):
     """
     Send a message to a RabbitMQ exchange
@@ -34,37 +129,28 @@ async def send_message(exchange_name: str, routing_key: str, message: Dict[str,
         message: The message content as a dictionary
     """
     try:
-        connection = await get_rabbitmq_connection()
-        channel = await connection.channel()
-        
-        # Declare exchange
-        exchange = await channel.declare_exchange(
-            exchange_name,
-            aio_pika.ExchangeType.TOPIC,
-            durable=True
-        )
-        
-        # Serialize message to JSON
-        message_body = json.dumps(message).encode()
+        # Pooled channel with the exchange already declared
+        exchange = await _get_exchange(exchange_name)
         
-        # Create a message with content type
-        amqp_message = aio_pika.Message(
-            body=message_body,
-            content_type="application/json" ,
-            delivery_mode=aio_pika.DeliveryMode.PERSISTENT
-        )
-        
-        # Publish message
-        await exchange.publish(
-            amqp_message,
-            routing_key=routing_key
-        )
+        # Publish message; returns once the broker confirms it. The channel is only
+        # locked while the frames are written, not while the confirm is awaited, so
+        # concurrent publishes on a channel are pipelined and confirmed in batches.
+        async with get_limiter("broker").slot():
+            await _publish_confirmed(exchange, exchange_name, routing_key, message)
         print(f"Publishing event to exchange={exchange_name}, routing_key={routing_key}, payload={message}")
         #logger.info(f"Sent message to {exchange_name} with routing key {routing_key}")
     except Exception as e:
         print(f"Failed to send message to RabbitMQ: {str(e)}")
         raise
 
+def _reservation_status_message(market_id: str, reservation_id: str, status: str, custom_payload: Dict[str, Any] = None) -> Dict[str, Any]:
+    return custom_payload or {
+        "event": "UPDATE_RESERVATION_STATUS",
+        "reservationId": reservation_id,
+        "market_id": market_id,
+        "vendorReservationStatus": status
+    }
+
 async def update_reservation_status(market_id: str, reservation_id: str, status: str, custom_payload: Dict[str, Any] = None):
     """
     Send a message to update the reservation status
@@ -74,17 +160,29 @@ async def update_reservation_status(market_id: str, reservation_id: str, status:
         status: The new status
         custom_payload: Optional custom message payload
     """
-    message = custom_payload or {
-        "event": "UPDATE_RESERVATION_STATUS",
-        "reservationId": reservation_id,
-        "market_id": market_id,
-        "vendorReservationStatus": status
-    }
-    
     await send_message(
         exchange_name="vendor_reservation",
         routing_key="reservation.status",
-        message=message
+        message=_reservation_status_message(market_id, reservation_id, status, custom_payload)
+    )
+
+async def update_reservation_statuses(updates: List[Dict[str, Any]]) -> List[Optional[Exception]]:
+    """
+    Send several reservation status updates as one pipelined batch (see publish_batch)
+
+    Args:
+        updates: Dicts with marketId, reservationId, status and optional payload
+
+    Returns:
+        None for each confirmed update, or the error it failed with, in list order
+    """
+    return await publish_batch(
+        "vendor_reservation",
+        "reservation.status",
+        [
+            _reservation_status_message(update["marketId"], update["reservationId"], update["status"], update.get("payload"))
+            for update in updates
+        ],
     )
 
 async def close_rabbitmq_connection():
@@ -92,6 +190,10 @@ async def close_rabbitmq_connection():
     Close the RabbitMQ connection
     """
     global _connection
+    for slot, publisher in enumerate(_publishers):
+        if publisher is not None and not publisher.channel.is_closed:
+            await publisher.channel.close()
+        _publishers[slot] = None
     if _connection and not _connection.is_closed:
         await _connection.close()
         logger.info("Closed RabbitMQ connection")
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+import aio_pika
+from pymongo import ReturnDocument
+from app.db.mongo import get_database
+from app.core.config import settings
+from app.messaging.rabbitmq import get_rabbitmq_connection
+from app.utils.cache import TTLCache
+from app.utils.metrics import mongo_request_seconds, register_cache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ReservationEntry:
+    vendor_id: Optional[str]
+    market_id: Optional[str]
+    status: Optional[str]
+
+
+# Mongo (one document per reservation, _id = reservation ID) is the source of truth;
+# this keeps hot reservations in memory so access checks rarely leave the process
+_index_cache = TTLCache(maxsize=settings.RESERVATION_INDEX_CACHE_SIZE, ttl=settings.RESERVATION_INDEX_CACHE_TTL_SEC)
+register_cache("reservation_index", _index_cache)
+_MISSING = object()
+_NEGATIVE_TTL_SEC = 30
+
+# Failed attempts per message body, to give up on a message that keeps failing
+_failed_attempts = TTLCache(maxsize=10000, ttl=3600)
+# Failures in a row across messages: while Mongo is down every message fails,
+# and the growing delay keeps them from cycling through the queue
+_consecutive_failures = 0
+
+_consumer_channel: Optional[aio_pika.abc.AbstractChannel] = None
+_stats: Dict[str, int] = {"consumed": 0, "applied": 0, "ignored": 0, "retried": 0, "rejected": 0}
+
+
+def _first(event: Dict[str, Any], *names: str) -> Optional[str]:
+    """Events from different publishers spell fields differently; take the first present."""
+    for name in names:
+        value = event.get(name)
+        if value not in (None, ""):
+            return str(value)
+    return None
+
+
+def _entry_from_document(doc: dict) -> ReservationEntry:
+    return ReservationEntry(vendor_id=doc.get("vendorId"), market_id=doc.get("marketId"), status=doc.get("status"))
+
+
+async def get_reservation(reservation_id: str) -> Optional[ReservationEntry]:
+    """
+    Look up who owns a reservation
+
+    Args:
+        reservation_id: The ID of the vendor reservation
+
+    Returns:
+        The indexed entry, or None if no event for it has been seen
+    """
+    cached = _index_cache.get(reservation_id, _MISSING)
+    if cached is not _MISSING:
+        return cached
+
+    collection = get_database()[settings.MONGO_DB_RESERVATION_INDEX]
+    with mongo_request_seconds.time(operation="find_reservation"):
+        doc = await collection.find_one({"_id": reservation_id})
+    if doc is None:
+        _index_cache.set(reservation_id, None, ttl=_NEGATIVE_TTL_SEC)
+        return None
+    entry = _entry_from_document(doc)
+    _index_cache.set(reservation_id, entry)
+    return entry
+
+
+async def apply_event(event: Dict[str, Any]) -> bool:
+    """
+    Fold one reservation event into the index
+
+    Only fields present in the event are written, so partial events (e.g. a
+    status change without the vendor) never erase what is already known.
+
+    Returns:
+        True if the event referenced a reservation and was applied
+    """
+    reservation_id = _first(event, "reservationId", "reservation_id", "vendorReservationId")
+    if reservation_id is None:
+        return False
+
+    fields = {
+        "vendorId": _first(event, "vendorId", "vendor_id", "userId", "user_id"),
+        "marketId": _first(event, "marketId", "market_id", "marketID"),
+        "status": _first(event, "vendorReservationStatus", "status"),
+    }
+    update = {name: value for name, value in fields.items() if value is not None}
+    update["updatedAt"] = datetime.now(timezone.utc)
+
+    collection = get_database()[settings.MONGO_DB_RESERVATION_INDEX]
+    doc = await collection.find_one_and_update(
+        {"_id": reservation_id},
+        {"$set": update},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    _index_cache.set(reservation_id, _entry_from_document(doc))
+    return True
+
+
+def _retry_delay(failures: int) -> float:
+    return min(0.5 * 2 ** (failures - 1), 30)
+
+
+async def _on_message(message: aio_pika.abc.AbstractIncomingMessage):
+    """
+    Malformed messages are acked and dropped. A failing Mongo write requeues the
+    message after a backoff, and after RESERVATION_CONSUMER_MAX_ATTEMPTS rejects
+    it without requeue (to the queue's dead-letter exchange, if a policy sets one).
+    """
+    global _consecutive_failures
+    async with message.process(requeue=True, ignore_processed=True):
+        _stats["consumed"] += 1
+        try:
+            event = json.loads(message.body)
+        except ValueError:
+            _stats["ignored"] += 1
+            logger.warning("Ignoring non-JSON reservation event")
+            return
+        try:
+            applied = isinstance(event, dict) and await apply_event(event)
+        except Exception as e:
+            _consecutive_failures += 1
+            body_hash = hashlib.sha256(message.body).hexdigest()
+            attempts = _failed_attempts.get(body_hash, 0) + 1
+            if attempts >= settings.RESERVATION_CONSUMER_MAX_ATTEMPTS:
+                _failed_attempts.pop(body_hash)
+                _stats["rejected"] += 1
+                logger.error("Rejecting reservation event after %d attempts: %s", attempts, e)
+                await message.reject(requeue=False)
+                return
+            _failed_attempts.set(body_hash, attempts)
+            _stats["retried"] += 1
+            delay = _retry_delay(_consecutive_failures)
+            logger.warning("Could not apply reservation event (attempt %d), requeueing in %.1fs: %s", attempts, delay, e)
+            # Held unacked meanwhile, so the prefetch window also throttles delivery
+            await asyncio.sleep(delay)
+            await message.nack(requeue=True)
+            return
+        _consecutive_failures = 0
+        if applied:
+            _stats["applied"] += 1
+        else:
+            _stats["ignored"] += 1
+
+
+async def start_reservation_consumer():
+    """
+    Consume reservation events into the index (call from the app lifespan)
+
+    Uses its own durable queue bound to the vendor_reservation exchange, so it
+    receives a copy of each event instead of competing with the reservation
+    service for messages on reservation_status_queue.
+    """
+    global _consumer_channel
+    connection = await get_rabbitmq_connection()
+    _consumer_channel = await connection.channel()
+    await _consumer_channel.set_qos(prefetch_count=settings.RESERVATION_CONSUMER_PREFETCH)
+
+    exchange = await _consumer_channel.declare_exchange(
+        "vendor_reservation",
+        aio_pika.ExchangeType.TOPIC,
+        durable=True
+    )
+    queue = await _consumer_channel.declare_queue(settings.RESERVATION_INDEX_QUEUE, durable=True)
+    for routing_key in settings.RESERVATION_INDEX_ROUTING_KEYS.split(","):
+        await queue.bind(exchange, routing_key=routing_key.strip())
+    await queue.consume(_on_message)
+    logger.info("Consuming reservation events from %s", settings.RESERVATION_INDEX_QUEUE)
+
+
+async def stop_reservation_consumer():
+    global _consumer_channel
+    if _consumer_channel is not None and not _consumer_channel.is_closed:
+        await _consumer_channel.close()
+    _consumer_channel = None
+
+
+def get_reservation_index_stats() -> Dict[str, Any]:
+    return {**_stats, "cache": _index_cache.stats()}
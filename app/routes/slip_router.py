@@ -1,26 +1,90 @@
+import io
 import os
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+import json
+import asyncio
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from typing import List, Dict, Any
-from pydantic import BaseModel
+from typing import List, Dict, Any, Optional, AsyncIterator, Literal
+from pydantic import BaseModel, Field
 import uuid
 from datetime import datetime
 from PIL import Image
-from app.core.image_check import validate_image
+from app.core.image_check import ValidatedImage, validate_image_async, validate_image_header, MAX_BYTES, HEADER_BYTES
+from app.core.image_processing import normalize_upload, thumbnail_key
+from app.utils.content_hash import content_addressed_key, file_extension, is_safe_key_segment
+from pymongo.errors import DuplicateKeyError
 
 # Authentication and authorization imports
 # - get_user_from_token: Validates token and returns UserInfo
 # - require_role: Creates a dependency that requires a specific role
 from app.auth.auth import get_user_from_token, require_role
-from app.utils.s3 import upload_file_to_s3, generate_presigned_url
+from app.utils.s3 import (
+    upload_file_to_s3_async,
+    generate_presigned_urls,
+    generate_presigned_post,
+    validate_images_exist,
+    read_object_range,
+    delete_with_image_key,
+)
 from app.messaging.rabbitmq import update_reservation_status, send_message
+from app.messaging.outbox import notify_outbox
+from app.messaging.reservation_index import get_reservation
+from app.core.config import settings
 from app import crud
+from app.db import idempotency
+from app.utils.metrics import stage
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 security = HTTPBearer()
 
 class SlipUrlResponse(BaseModel):
     slip_urls: List[str]
+    # Set when more slips follow; pass it back as `after` for the next page
+    next_cursor: Optional[str] = None
+
+# Page size when a request does not give `limit`
+DEFAULT_PAGE_SIZE = 50
+# Page size cap for the listing (first pages up to this are served from cache),
+# and how many streamed slips are signed per batch
+MAX_PAGE_SIZE = crud.MAX_CACHED_PAGE_SIZE
+STREAM_SIGN_BATCH = 100
+
+# Slips per page of the bulk listing, by default and at most
+DEFAULT_BULK_PAGE_SIZE = 500
+MAX_BULK_PAGE_SIZE = 1000
+
+# Listing endpoints can return the full image or, when one was generated, its thumbnail
+ImageVariant = Literal["full", "thumbnail"]
+
+class BulkSlipRequest(BaseModel):
+    reservationIds: Optional[List[str]] = None
+    marketId: Optional[str] = None
+    variant: ImageVariant = "full"
+    limit: int = Field(DEFAULT_BULK_PAGE_SIZE, ge=1, le=MAX_BULK_PAGE_SIZE)
+    after: Optional[str] = None
+
+class BulkSlipUrlResponse(BaseModel):
+    reservations: Dict[str, List[str]]
+    # Set when more slips follow; resend the request with it as `after`
+    next_cursor: Optional[str] = None
+
+# Upper bound on reservationIds per bulk request
+MAX_BULK_RESERVATIONS = 500
+
+class UploadIntentRequest(BaseModel):
+    reservationId: str
+    marketId: str
+    filename: str
+    contentType: str
+
+class UploadCompleteRequest(BaseModel):
+    slipKey: str
+    reservationId: str
+    marketId: str
     
 async def check_slip_access(user_info, reservation_id: str) -> bool:
     """
@@ -43,105 +107,436 @@ async def check_slip_access(user_info, reservation_id: str) -> bool:
         
     # Vendor has access only to their own reservations
     if user_info.role == "vendor":
-        # TODO: Check if this reservation belongs to this vendor by querying the reservation service
-        # For now, implement a simple check (this should be improved in production)
+        # Ownership comes from the local reservation index fed by reservation events
         try:
-            # Get the reservation and check if it belongs to this user
-            # This is a placeholder - replace with actual reservation lookup
-            # For demo purposes, we're granting access to all vendors
-            return True
+            entry = await get_reservation(reservation_id)
         except Exception:
             return False
+        if entry is None or entry.vendor_id is None:
+            # Not indexed yet (or no vendor in any event so far)
+            return not settings.RESERVATION_OWNERSHIP_STRICT
+        return entry.vendor_id == user_info.user_id
             
     return False
 
+async def record_slip(
+    slip_key: str,
+    market_id: str,
+    reservation_id: str,
+    thumb_key: Optional[str] = None,
+    content_hash: Optional[str] = None,
+) -> dict:
+    """
+    Create the slip and tell the reservation service it is waiting for validation.
+
+    With the outbox enabled the event is committed together with the slip and
+    published by the background relay, so the broker is off the request path.
+    Raises DuplicateKeyError (and publishes nothing) if the reservation already
+    has a slip with this content_hash.
+    """
+    message_payload = {
+        "event": "UPDATE_RESERVATION_STATUS",
+        "reservationId": reservation_id,
+        "marketId": market_id,
+        "vendorReservationStatus": "ValidateSlip"
+    }
+    if settings.SLIP_OUTBOX_ENABLED:
+        with stage("mongo_insert"):
+            slip = await crud.create_slip(
+                slip_key, market_id, reservation_id,
+                outbox_event={"status": "ValidateSlip", "payload": message_payload},
+                thumb_key=thumb_key,
+                content_hash=content_hash,
+            )
+        notify_outbox()
+        return slip
+
+    with stage("mongo_insert"):
+        slip = await crud.create_slip(
+            slip_key, market_id, reservation_id, thumb_key=thumb_key, content_hash=content_hash
+        )
+    with stage("publish"):
+        await update_reservation_status(
+            market_id,
+            reservation_id,
+            "ValidateSlip",
+            message_payload
+        )
+    return slip
+
+def _slip_response(slip: dict, message: str = "Slip uploaded successfully") -> dict:
+    return {
+        "message": message,
+        "id": slip["id"],
+        "slipKey": slip["slipKey"],
+        "marketID": slip["marketID"],
+        "vendorReservationID": slip["vendorReservationID"],
+    }
+
+def _image_key(slip: dict, variant: str) -> str:
+    """Thumbnail key when requested and available, otherwise the full-size slip."""
+    if variant == "thumbnail" and slip.get("thumbKey"):
+        return slip["thumbKey"]
+    return slip["slipKey"]
+
+async def _ndjson_slip_urls(slips: AsyncIterator[dict], variant: str = "full") -> AsyncIterator[str]:
+    """Turn a slip cursor into NDJSON lines, signing URLs one small batch at a time."""
+    chunk: List[dict] = []
+
+    async def _render(batch: List[dict]) -> str:
+        keys = [_image_key(slip, variant) for slip in batch]
+        urls = await generate_presigned_urls(keys)
+        return "".join(
+            json.dumps({
+                "id": slip["id"],
+                "vendorReservationID": slip["vendorReservationID"],
+                "url": urls[key],
+            }) + "\n"
+            for slip, key in zip(batch, keys)
+            if key in urls
+        )
+
+    async for slip in slips:
+        chunk.append(slip)
+        if len(chunk) >= STREAM_SIGN_BATCH:
+            yield await _render(chunk)
+            chunk = []
+    if chunk:
+        yield await _render(chunk)
+
 @router.get("/reservation/{reservation_id}", response_model=SlipUrlResponse)
 async def get_slips_by_reservation_id(
     reservation_id: str, 
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    variant: ImageVariant = "full",
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
     # Verify user authentication
     user_info = await get_user_from_token(credentials.credentials)
     
     # Check if user has access to this reservation's slips
-    has_access = await check_slip_access(user_info, reservation_id)
+    with stage("access_check"):
+        has_access = await check_slip_access(user_info, reservation_id)
     if not has_access:
         raise HTTPException(
             status_code=403,
             detail="You don't have permission to view these slips"
         )
     
-    # Get all slips for this reservation
-    slips = await crud.get_slips_by_reservation_id(reservation_id)
-    slip_urls = []
-    for slip in slips:
+    # Get one page of this reservation's slips (the stream endpoint lists them all)
+    with stage("mongo_query"):
+        try:
+            slips, next_cursor = await crud.get_slips_page(reservation_id, limit, after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    # Signed in one batch off the event loop; still-valid URLs are reused so browsers can cache them
+    keys = [_image_key(slip, variant) for slip in slips]
+    with stage("presign"):
+        urls = await generate_presigned_urls(keys)
+    slip_urls = [urls[key] for key in keys if key in urls]
+    return {"slip_urls": slip_urls, "next_cursor": next_cursor}
+
+@router.get("/reservation/{reservation_id}/stream")
+async def stream_slips_by_reservation_id(
+    reservation_id: str,
+    variant: ImageVariant = "full",
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Stream a reservation's slips as NDJSON while the Mongo cursor produces them."""
+    user_info = await get_user_from_token(credentials.credentials)
+    if not await check_slip_access(user_info, reservation_id):
+        raise HTTPException(status_code=403, detail="You don't have permission to view these slips")
+    slips = crud.iter_slips(vendor_reservation_id=reservation_id)
+    return StreamingResponse(_ndjson_slip_urls(slips, variant), media_type="application/x-ndjson")
+
+@router.get("/market/{market_id}/stream")
+async def stream_slips_by_market_id(
+    market_id: str,
+    variant: ImageVariant = "full",
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Stream every slip of a market as NDJSON (organizers and admins only)."""
+    user_info = await get_user_from_token(credentials.credentials)
+    if user_info.role not in ("organizer", "admin"):
+        raise HTTPException(status_code=403, detail="You don't have permission to view these slips")
+    slips = crud.iter_slips(market_id=market_id)
+    return StreamingResponse(_ndjson_slip_urls(slips, variant), media_type="application/x-ndjson")
+
+@router.post("/reservations", response_model=BulkSlipUrlResponse)
+async def get_slips_for_reservations(
+    body: BulkSlipRequest,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Slip URLs for many reservations (by ID list or whole market) in one call,
+    grouped by reservation ID, one page of slips at a time.
+    """
+    if (body.reservationIds is None) == (body.marketId is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of reservationIds or marketId")
+    if body.reservationIds is not None and len(body.reservationIds) > MAX_BULK_RESERVATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_RESERVATIONS} reservationIds per request")
+
+    # Verify user authentication once for the whole batch
+    user_info = await get_user_from_token(credentials.credentials)
+
+    if body.marketId is not None:
+        # Listing a whole market is an organizer/admin view
+        if user_info.role not in ("organizer", "admin"):
+            raise HTTPException(status_code=403, detail="You don't have permission to view these slips")
+        query = {"market_id": body.marketId}
+        grouped: Dict[str, List[str]] = {}
+    else:
+        reservation_ids = list(dict.fromkeys(body.reservationIds))
+        with stage("access_check"):
+            access = await asyncio.gather(*(check_slip_access(user_info, r) for r in reservation_ids))
+        if not all(access):
+            raise HTTPException(status_code=403, detail="You don't have permission to view these slips")
+        query = {"vendor_reservation_ids": reservation_ids}
+        grouped = {r: [] for r in reservation_ids}
+
+    with stage("mongo_query"):
         try:
-            url = generate_presigned_url(slip["slipKey"])  # Fixed typo: slit -> slip
-            slip_urls.append(url)
-        except Exception as e:
-            print(f"Error generating URL for slip {slip['id']}: {str(e)}")
-    return {"slip_urls": slip_urls}
+            slips, next_cursor = await crud.get_slip_keys_for_reservations(
+                **query, limit=body.limit, after=body.after
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    keys = [_image_key(slip, body.variant) for slip in slips]
+    with stage("presign"):
+        urls = await generate_presigned_urls(keys)
+    for slip, key in zip(slips, keys):
+        url = urls.get(key)
+        if url is not None:
+            grouped.setdefault(slip["vendorReservationID"], []).append(url)
+    return {"reservations": grouped, "next_cursor": next_cursor}
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
 
 @router.post("/create", status_code=status.HTTP_201_CREATED)
 async def create_slip(
+    response: Response,
     slipFile: UploadFile = File(...),
     reservationId: str = Form(...),
     marketId: str = Form(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     user_info = Depends(require_role("vendor"))
 ):
     # User is already verified as a vendor by the require_role dependency
+    if not idempotency_key:
+        return await _create_slip(response, slipFile, reservationId, marketId)
+    if len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
     
+    # Keys are per user, and bound to the reservation, market and image bytes they
+    # were first used with (clients often resend the same filename for new images)
+    _check_upload(slipFile, reservationId)
+    with stage("validate"):
+        validated = await validate_image_async(slipFile)
+    key = f"{user_info.user_id}:{idempotency_key}"
+    fingerprint = idempotency.request_fingerprint(reservationId, marketId, validated.sha256)
+    try:
+        stored = await idempotency.claim(key, fingerprint)
+    except idempotency.IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    except idempotency.IdempotencyInProgress:
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still in progress",
+            headers={"Retry-After": "1"},
+        )
+    if stored is not None:
+        # Replay: no S3, Mongo slip or broker work
+        response.status_code = stored["statusCode"]
+        response.headers["Idempotent-Replayed"] = "true"
+        return stored["body"]
+    
+    try:
+        async with idempotency.keep_claimed(key):
+            body = await _create_slip(response, slipFile, reservationId, marketId, validated)
+    except BaseException:
+        # Failed (or cancelled) requests are not stored; a retry runs again
+        await asyncio.shield(idempotency.release(key))
+        raise
+    await idempotency.complete(key, response.status_code or status.HTTP_201_CREATED, body)
+    return body
+
+def _check_upload(slipFile: UploadFile, reservationId: str):
+    # The reservation ID becomes the S3 key prefix
+    if not is_safe_key_segment(reservationId):
+        raise HTTPException(status_code=400, detail="Invalid reservationId")
     # Validate the file is an image
     if not slipFile.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Only image files are allowed")
+    if slipFile.file is None:
+        raise HTTPException(status_code=400, detail="No file uploaded")
+
+async def _create_slip(
+    response: Response,
+    slipFile: UploadFile,
+    reservationId: str,
+    marketId: str,
+    validated: Optional[ValidatedImage] = None,
+) -> dict:
+    # Validate image integrity (magic bytes inline, Pillow in the validation pool);
+    # the same read of the upload yields its content hash
+    if validated is None:
+        _check_upload(slipFile, reservationId)
+        with stage("validate"):
+            validated = await validate_image_async(slipFile)
+    content_hash = validated.sha256
+    
+    # Same bytes for the same reservation (e.g. a retry after a timeout) return the
+    # existing slip: no S3 PUT, no insert, no second ValidateSlip event
+    with stage("dedup_lookup"):
+        existing = await crud.get_slip_by_content_hash(reservationId, content_hash)
+    if existing is not None:
+        response.status_code = status.HTTP_200_OK
+        return _slip_response(existing, "Slip already uploaded")
     
-    # Validate image integrity
-    validate_image(slipFile)
+    # Optional: strip EXIF, downscale, re-encode and build a thumbnail (image pool)
+    normalized = None
+    if settings.IMAGE_NORMALIZE_ENABLED:
+        with stage("normalize"):
+            normalized = await normalize_upload(slipFile)
 
 
     try:
         # 1. Upload image to S3
-        # Generate a unique key for the file
-        unique_filename = f"{uuid.uuid4()}_{datetime.now().timestamp()}_{slipFile.filename}"
-        
-        # check slipFile.file is not None
-        if slipFile.file is None:
-            raise HTTPException(status_code=400, detail="No file uploaded")
-        # check slipFile.file is image (slipfile is binary file)
-        if not slipFile.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="Only image files are allowed")
-
-        # Upload to S3 and get the file key
-        slip_key = upload_file_to_s3(slipFile.file, unique_filename, slipFile.content_type)
-        
-        # 2. Create slip record in MongoDB
-        slip = await crud.create_slip(slip_key, marketId, reservationId)
-        
-        # 3. Send message to RabbitMQ to update reservation status
-        message_payload = {
-            "event": "UPDATE_RESERVATION_STATUS",
-            "reservationId": reservationId,
-            "marketId": slip["marketID"],
-            "vendorReservationStatus": "ValidateSlip"
-        }
+        # The key is derived from the original bytes, so a concurrent duplicate
+        # overwrites the same object with identical content
+        thumb_key = None
+        with stage("s3_upload"):
+            if normalized is None:
+                slip_key = content_addressed_key(reservationId, content_hash, file_extension(slipFile.filename))
+                # Upload to S3 and get the file key
+                slip_key = await upload_file_to_s3_async(slipFile.file, slip_key, slipFile.content_type)
+            else:
+                slip_key = content_addressed_key(reservationId, content_hash, normalized.extension)
+                slip_key, thumb_key = await asyncio.gather(
+                    upload_file_to_s3_async(io.BytesIO(normalized.data), slip_key, normalized.content_type),
+                    upload_file_to_s3_async(io.BytesIO(normalized.thumbnail), thumbnail_key(slip_key), normalized.content_type),
+                )
         
-        await update_reservation_status(
-            slip["marketID"],
-            reservationId, 
-            "ValidateSlip",
-            message_payload
-        )
+        # 2. Create slip record in MongoDB and 3. queue the reservation status update
+        try:
+            slip = await record_slip(slip_key, marketId, reservationId, thumb_key, content_hash)
+        except DuplicateKeyError:
+            # Lost the race against an identical upload; its slip is the answer
+            existing = await crud.get_slip_by_content_hash(reservationId, content_hash)
+            if existing is None:
+                raise
+            response.status_code = status.HTTP_200_OK
+            return _slip_response(existing, "Slip already uploaded")
         
         # Generate a URL for the uploaded slip
         # slip_url = generate_presigned_url(slip_key)
         
-        return {
-            "message": "Slip uploaded successfully",
-            "id": slip["id"],
-            "slipKey": slip["slipKey"],
-            "marketID": slip["marketID"],
-            "vendorReservationID": slip["vendorReservationID"],
-        }
+        return _slip_response(slip)
+    except HTTPException:
+        # e.g. 503 Overloaded from a saturated downstream; keep its status and Retry-After
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to upload slip: {str(e)}")
+
+@router.post("/upload-intent")
+async def create_upload_intent(
+    body: UploadIntentRequest,
+    user_info = Depends(require_role("vendor"))
+):
+    """
+    Step 1 of a direct browser upload: return a presigned POST limited to one
+    key, one image content type and MAX_BYTES. The uploader, reservation and
+    market are pinned as object metadata so /complete can check them.
+    """
+    if not body.contentType.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Only image files are allowed")
+
+    slip_key = f"{uuid.uuid4()}_{datetime.now().timestamp()}_{os.path.basename(body.filename)}"
+    try:
+        post = generate_presigned_post(
+            slip_key,
+            body.contentType,
+            MAX_BYTES,
+            metadata={"uploader": user_info.user_id, "reservation": body.reservationId, "market": body.marketId},
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create upload intent: {str(e)}")
+
+    return {
+        "slipKey": slip_key,
+        "url": post["url"],
+        "fields": post["fields"],
+        "maxBytes": MAX_BYTES,
+    }
+
+@router.post("/complete", status_code=status.HTTP_201_CREATED)
+async def complete_upload(
+    response: Response,
+    body: UploadCompleteRequest,
+    user_info = Depends(require_role("vendor"))
+):
+    """
+    Step 2 of a direct browser upload: verify the object S3 received, then
+    record the slip and publish the ValidateSlip event exactly like /create.
+
+    Idempotent per slipKey: a retried call returns the slip recorded by the
+    first one (200) instead of recording and publishing it again.
+    """
+    loop = asyncio.get_running_loop()
+    head = await loop.run_in_executor(None, validate_images_exist, body.slipKey)
+
+    metadata = head.get("Metadata", {})
+    if (
+        metadata.get("uploader") != user_info.user_id
+        or metadata.get("reservation") != body.reservationId
+        or metadata.get("market") != body.marketId
+    ):
+        raise HTTPException(status_code=403, detail="Upload does not belong to this reservation")
+
+    existing = await crud.get_slip_by_key(body.slipKey)
+    if existing is not None:
+        response.status_code = status.HTTP_200_OK
+        return _slip_response(existing, "Slip already uploaded")
+
+    size = head.get("ContentLength", 0)
+    head_bytes = b""
+    if 0 < size <= MAX_BYTES:
+        try:
+            head_bytes = await loop.run_in_executor(
+                None, read_object_range, body.slipKey, 0, min(HEADER_BYTES, size) - 1
+            )
+        except RuntimeError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+
+    try:
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty file")
+        if size > MAX_BYTES:
+            raise HTTPException(status_code=413, detail="File too large")
+        validate_image_header(head_bytes)
+    except HTTPException:
+        # Never keep an object that failed validation
+        try:
+            await loop.run_in_executor(None, delete_with_image_key, body.slipKey)
+        except HTTPException as e:
+            logger.warning("Failed to delete rejected upload %s: %s", body.slipKey, e.detail)
+        raise
+
+    try:
+        slip = await record_slip(body.slipKey, body.marketId, body.reservationId)
+        return _slip_response(slip)
+    except DuplicateKeyError:
+        # A concurrent /complete for the same object won the insert (slipKey is unique)
+        existing = await crud.get_slip_by_key(body.slipKey)
+        if existing is None:
+            raise HTTPException(status_code=409, detail="Slip is being recorded, retry shortly")
+        response.status_code = status.HTTP_200_OK
+        return _slip_response(existing, "Slip already uploaded")
+    except HTTPException:
+        # e.g. 503 Overloaded from a saturated downstream; keep its status and Retry-After
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload slip: {str(e)}")
 
@@ -0,0 +1,207 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Iterable, Optional
+from fastapi import HTTPException
+from app.core.config import settings
+from app.utils.metrics import CallbackMetric
+
+
+class Overloaded(HTTPException):
+    """503 with Retry-After; raised when a limiter's wait queue is full or its deadline passes."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail=f"Service is overloaded ({name}), please retry later",
+            headers={"Retry-After": str(int(max(retry_after, 1)))},
+        )
+        self.limiter = name
+
+
+class AdmissionLimiter:
+    """
+    Concurrency limit with a bounded, deadline-limited wait queue
+
+    At most `limit` callers hold a slot. Up to `max_waiting` more may wait for
+    one, each for at most `wait_timeout` seconds; everyone else is rejected
+    immediately with Overloaded instead of piling up behind a slow dependency.
+
+    Args:
+        name: Label used in errors and stats
+        limit: Concurrent slots
+        max_waiting: Callers allowed to queue for a slot
+        wait_timeout: Longest a caller queues before being rejected
+        retry_after: Seconds suggested to rejected clients
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int, wait_timeout: float, retry_after: float = 1):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _reject(self) -> Overloaded:
+        self.rejected += 1
+        return Overloaded(self.name, self.retry_after)
+
+    async def acquire(self):
+        # Created lazily so it binds to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                raise self._reject()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.wait_timeout)
+            except asyncio.TimeoutError:
+                raise self._reject()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        self.admitted += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Wait until no slot is held (e.g. on shutdown); False if the timeout passed first."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.in_flight and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        return self.in_flight == 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+def _limiter(name: str, limit: int, max_waiting: int) -> AdmissionLimiter:
+    return AdmissionLimiter(
+        name,
+        limit,
+        max_waiting,
+        wait_timeout=settings.ADMISSION_QUEUE_TIMEOUT_SEC,
+        retry_after=settings.ADMISSION_RETRY_AFTER_SEC,
+    )
+
+
+# One limiter per worker for the upload route and each downstream on its path.
+# Read endpoints only pass through the auth limiter, so an upload surge cannot
+# take the slots they need for S3 signing or Mongo reads.
+limiters: Dict[str, AdmissionLimiter] = {
+    "upload": _limiter("upload", settings.ADMISSION_UPLOAD_CONCURRENCY, settings.ADMISSION_UPLOAD_QUEUE),
+    "s3": _limiter("s3", settings.S3_MAX_INFLIGHT_UPLOADS, settings.ADMISSION_DOWNSTREAM_QUEUE),
+    "mongo": _limiter("mongo", settings.ADMISSION_MONGO_CONCURRENCY, settings.ADMISSION_DOWNSTREAM_QUEUE),
+    "auth": _limiter("auth", settings.ADMISSION_AUTH_CONCURRENCY, settings.ADMISSION_DOWNSTREAM_QUEUE),
+    "broker": _limiter("broker", settings.ADMISSION_BROKER_CONCURRENCY, settings.ADMISSION_DOWNSTREAM_QUEUE),
+}
+
+
+def _limiter_field(field: str):
+    return lambda: [((name,), getattr(limiter, field)) for name, limiter in limiters.items()]
+
+
+# upload in_flight is the number of uploads being received or processed right now
+CallbackMetric("slip_admission_in_flight", "Slots in use per limiter", ["limiter"], _limiter_field("in_flight"))
+CallbackMetric("slip_admission_waiting", "Callers queued per limiter", ["limiter"], _limiter_field("waiting"))
+CallbackMetric("slip_admission_limit", "Slots per limiter", ["limiter"], _limiter_field("limit"))
+CallbackMetric(
+    "slip_admission_rejected_total", "Calls rejected with 503 per limiter", ["limiter"], _limiter_field("rejected"),
+    kind="counter",
+)
+
+
+def get_limiter(name: str) -> AdmissionLimiter:
+    return limiters[name]
+
+
+async def drain_limiters(names: Iterable[str], timeout: float) -> Dict[str, bool]:
+    """Wait for in-flight downstream calls to finish before their pools are closed."""
+    results = await asyncio.gather(*(limiters[name].wait_idle(timeout) for name in names))
+    return dict(zip(names, results))
+
+
+def get_admission_stats() -> Dict[str, Any]:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+class UploadAdmissionMiddleware:
+    """
+    ASGI middleware that admits upload requests before their body is read
+
+    Requests to `paths` are rejected with 413 when Content-Length is over
+    `max_body_bytes`, and with 503 + Retry-After when the upload limiter is
+    saturated; admitted requests hold their slot while the body is spooled and
+    the route runs.
+    """
+
+    def __init__(self, app, paths: Iterable[str], max_body_bytes: int, limiter: Optional[AdmissionLimiter] = None):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.max_body_bytes = max_body_bytes
+        self.limiter = limiter or get_limiter("upload")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None:
+            try:
+                too_large = int(content_length) > self.max_body_bytes
+            except ValueError:
+                await _send_error(send, 400, "Invalid Content-Length")
+                return
+            if too_large:
+                await _send_error(send, 413, "File too large")
+                return
+
+        try:
+            await self.limiter.acquire()
+        except Overloaded as e:
+            await _send_error(send, e.status_code, e.detail, e.headers)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+
+async def _send_error(send, status_code: int, detail: str, headers: Optional[Dict[str, str]] = None):
+    body = json.dumps({"detail": detail}).encode()
+    raw_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        # The body was never read; tell the client not to reuse the connection
+        (b"connection", b"close"),
+    ]
+    raw_headers.extend((name.lower().encode(), value.encode()) for name, value in (headers or {}).items())
+    await send({"type": "http.response.start", "status": status_code, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
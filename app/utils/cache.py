@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import bson
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Bounded in-process cache with per-entry TTL and LRU eviction.
+
+    Args:
+        maxsize: Maximum number of entries kept; the least recently used entry is evicted first
+        ttl: Default lifetime of an entry in seconds
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        lifetime = self.ttl if ttl is None else ttl
+        self._data[key] = (value, time.monotonic() + lifetime)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_sec": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one in-flight execution.
+
+    The work runs in its own task, so a caller that gets cancelled does not
+    cancel the result the other waiters are sharing.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable):
+        """
+        Let the next call for `key` start a fresh execution. The running one
+        still finishes for the callers already waiting on it.
+        """
+        self._inflight.pop(key, None)
+
+    def is_current(self, key: Hashable) -> bool:
+        """True when called from the execution still registered for `key` (not forgotten)."""
+        task = self._inflight.get(key)
+        return task is not None and task is asyncio.current_task()
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even when every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+# -----------------------------------------------------------------------------
+# Async cache backends (shared interface for in-process and cross-worker caches)
+# -----------------------------------------------------------------------------
+_ABSENT = object()
+
+
+class LocalCacheBackend:
+    """
+    Per-process backend on top of TTLCache. Each worker has its own copy, so an
+    invalidation only reaches the worker that made it; other workers catch up
+    when their entry expires.
+    """
+
+    name = "local"
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Tuple[bool, Any]:
+        value = self.cache.get(key, _ABSENT)
+        if value is _ABSENT:
+            return False, None
+        return True, value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.cache.set(key, value, ttl=ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.cache.pop(key)
+
+    async def close(self):
+        self.cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, **self.cache.stats()}
+
+
+class RedisCacheBackend:
+    """
+    Backend shared by every worker through Redis (needs the `redis` package)
+
+    Values are BSON-encoded, so documents with ObjectIds round-trip unchanged.
+    Redis errors count as misses: a cache outage slows reads down but never
+    fails them. Eviction is left to the server's maxmemory policy.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, ttl: float, prefix: str = "slipcache:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("SLIP_CACHE_BACKEND=redis needs the 'redis' package") from e
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._client = redis_asyncio.from_url(url)
+
+    async def get(self, key: str) -> Tuple[bool, Any]:
+        try:
+            raw = await self._client.get(self.prefix + key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Redis cache get failed: %s", e)
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, bson.decode(raw)["v"]
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        lifetime = self.ttl if ttl is None else ttl
+        try:
+            await self._client.set(self.prefix + key, bson.encode({"v": value}), px=int(lifetime * 1000))
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Redis cache set failed: %s", e)
+
+    async def delete(self, *keys: str):
+        if not keys:
+            return
+        try:
+            await self._client.delete(*(self.prefix + key for key in keys))
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Redis cache invalidation failed: %s", e)
+
+    async def close(self):
+        await self._client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "size": 0,  # not tracked per worker
+            "ttl_sec": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": 0,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,29 @@
+import os
+import re
+
+# Client-supplied reservation IDs become the first segment of the S3 key: one plain
+# segment, so no "/", no "." or ".." segment and no control characters
+_KEY_SEGMENT = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,127}")
+
+
+def is_safe_key_segment(value: str) -> bool:
+    return _KEY_SEGMENT.fullmatch(value or "") is not None
+
+
+def content_addressed_key(vendor_reservation_id: str, content_hash: str, extension: str) -> str:
+    """
+    S3 key derived from the image bytes, so the same upload always maps to the same object
+
+    Scoped per reservation: deleting one reservation's slip never removes an
+    object another reservation still points to.
+
+    Raises:
+        ValueError: The reservation ID is not a plain key segment
+    """
+    if not is_safe_key_segment(vendor_reservation_id):
+        raise ValueError("Invalid reservation ID")
+    return f"{vendor_reservation_id}/{content_hash}{extension.lower()}"
+
+
+def file_extension(filename: str) -> str:
+    return os.path.splitext(os.path.basename(filename or ""))[1]
@@ -0,0 +1,282 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Prometheus text exposition without an extra dependency. Metrics are per worker
+# process; scrape each worker (or sum in Prometheus) when running several.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans cache hits (~1 ms) to slow multipart uploads
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()  # S3 calls record from worker threads
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts, sum, count)
+        self._series: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the block (errors included)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        inf = 'le="+Inf"'
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, inf)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    Gauge or counter read at scrape time from state the code already keeps
+    (cache stats, breaker snapshots, pool counters)
+
+    Args:
+        collect: Returns [(label values, value), ...]
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str],
+        collect: Callable[[], Iterable[Tuple[LabelValues, float]]],
+        kind: str = "gauge",
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self._collect = collect
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, value in self._collect():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+_registry: List[_Metric] = []
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            # One broken collector must not take down the whole scrape
+            lines.append(f"# {metric.name} failed: {_escape(e)}")
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------------------------------------------------------
+# Slip pipeline metrics
+# -----------------------------------------------------------------------------
+stage_seconds = Histogram(
+    "slip_stage_seconds", "Time spent in each stage of a slip request", ["stage"]
+)
+auth_request_seconds = Histogram(
+    "slip_auth_request_seconds", "Auth service HTTP calls by endpoint and path", ["endpoint", "path", "status"]
+)
+s3_request_seconds = Histogram(
+    "slip_s3_request_seconds", "S3 calls by operation", ["operation"]
+)
+mongo_request_seconds = Histogram(
+    "slip_mongo_request_seconds", "MongoDB calls by operation", ["operation"]
+)
+broker_publish_seconds = Histogram(
+    "slip_broker_publish_seconds", "RabbitMQ publishes until confirmed, by exchange", ["exchange"]
+)
+retries_total = Counter(
+    "slip_retries_total", "Calls retried or failed over, by downstream", ["downstream"]
+)
+http_request_seconds = Histogram(
+    "slip_http_request_seconds", "HTTP requests by route and status", ["method", "route", "status"]
+)
+
+def timed(histogram: Histogram, **labels):
+    """Decorator observing each call of an async function into `histogram`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Per-request stage timings for the Server-Timing header
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("slip_request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time one pipeline stage into slip_stage_seconds and the response's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording slip_http_request_seconds and adding a Server-Timing
+    header listing each stage() that ran during the request plus the total
+    """
+
+    def __init__(self, app, exclude_paths: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                entries = [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in timings]
+                entries.append(f"total;dur={(time.perf_counter() - start) * 1000:.1f}")
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", ", ".join(entries).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # Route name (the endpoint function) rather than the raw path keeps label cardinality bounded
+            route = scope.get("route")
+            route_name = getattr(route, "name", None) or "unmatched"
+            http_request_seconds.observe(
+                time.perf_counter() - start, method=scope["method"], route=route_name, status=status_code
+            )
+
+
+# -----------------------------------------------------------------------------
+# Cache hit/miss counters, read from each TTLCache's own stats
+# -----------------------------------------------------------------------------
+_caches: Dict[str, Any] = {}
+
+
+def register_cache(name: str, cache) -> None:
+    """Export a TTLCache's hits/misses/evictions under cache=`name`."""
+    _caches[name] = cache
+
+
+def _cache_counter(field: str) -> Callable[[], List[Tuple[LabelValues, float]]]:
+    return lambda: [((name,), cache.stats()[field]) for name, cache in _caches.items()]
+
+
+CallbackMetric("slip_cache_hits_total", "Cache hits by cache", ["cache"], _cache_counter("hits"), kind="counter")
+CallbackMetric("slip_cache_misses_total", "Cache misses by cache", ["cache"], _cache_counter("misses"), kind="counter")
+CallbackMetric("slip_cache_evictions_total", "Cache evictions by cache", ["cache"], _cache_counter("evictions"), kind="counter")
+CallbackMetric("slip_cache_entries", "Entries currently cached", ["cache"], _cache_counter("size"))
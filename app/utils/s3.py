@@ -1,8 +1,17 @@
-from aiohttp import ClientError
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional
 from fastapi import HTTPException
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from app.core.config import settings
-from botocore.exceptions import NoCredentialsError
+from app.core.image_check import MAX_BYTES
+from app.utils.cache import TTLCache
+from app.utils.admission import get_limiter
+from app.utils.metrics import register_cache, s3_request_seconds
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
 
 S3_BUCKET_NAME = settings.S3_BUCKET_NAME
 
@@ -11,7 +20,20 @@ s3_client = boto3.client(
     aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
     aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
     region_name=settings.REGION_NAME,
+    config=BotoConfig(max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS),
 )
+
+# Uploads are capped at MAX_BYTES (5 MB), and every multipart part but the last must
+# be at least 5 MB, so a slip can never be split into parallel parts. Send it as a
+# single PutObject on the calling executor thread, without the per-upload transfer
+# thread pool boto3 would otherwise start.
+transfer_config = TransferConfig(
+    multipart_threshold=MAX_BYTES + 1,
+    use_threads=False,
+)
+
+# boto3 is blocking; keep it off the event loop in a bounded pool
+_upload_executor = ThreadPoolExecutor(max_workers=settings.S3_UPLOAD_WORKERS, thread_name_prefix="s3-upload")
 print("AWS_ACCESS_KEY_ID =", settings.AWS_ACCESS_KEY_ID)
 print("AWS_SECRET_ACCESS_KEY =", settings.AWS_SECRET_ACCESS_KEY)
 print("REGION_NAME =", settings.REGION_NAME)
@@ -31,14 +53,41 @@ def upload_file_to_s3(file_obj, filename: str, content_type: str = None) -> str:
     """
     try:
         extra_args = {"ContentType": content_type} if content_type else {}
-        s3_client.upload_fileobj(file_obj, S3_BUCKET_NAME, filename, ExtraArgs=extra_args)
+        with s3_request_seconds.time(operation="upload"):
+            s3_client.upload_fileobj(file_obj, S3_BUCKET_NAME, filename, ExtraArgs=extra_args, Config=transfer_config)
         # Return only the key, not the full URL
         return filename
     except NoCredentialsError:
         raise RuntimeError("AWS credentials not found.")
     except Exception as e:
         raise RuntimeError(f"Failed to upload file: {e}")
-    
+
+
+async def upload_file_to_s3_async(file_obj, filename: str, content_type: str = None) -> str:
+    """
+    Non-blocking variant of upload_file_to_s3 for async routes
+
+    Waits for one of S3_MAX_INFLIGHT_UPLOADS slots, then runs the upload in the
+    dedicated S3 thread pool so the event loop keeps serving other requests.
+
+    Returns:
+        str: The key used in S3 (not the full URL)
+
+    Raises:
+        Overloaded: If no slot frees up within the admission deadline
+    """
+    async with get_limiter("s3").slot():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _upload_executor, partial(upload_file_to_s3, file_obj, filename, content_type)
+        )
+
+
+def shutdown_s3_executor():
+    """Wait for running uploads to finish and stop the S3 thread pool."""
+    _upload_executor.shutdown(wait=True)
+
+
 def get_presigned_url(filename: str, expires_in: int = 3600) -> str:
     """
     คืน URL สำหรับ GET ไฟล์จาก S3 (private bucket)
@@ -56,13 +105,112 @@ def get_presigned_url(filename: str, expires_in: int = 3600) -> str:
         
 # Alias for get_presigned_url to match function name in router.py
 generate_presigned_url = get_presigned_url
-    
+
+
+# A cached URL is only handed out while it still has S3_PRESIGN_MIN_REMAINING_SEC left,
+# so the entry lifetime is the URL lifetime minus that margin
+presigned_url_cache = TTLCache(
+    maxsize=settings.S3_PRESIGN_CACHE_SIZE,
+    ttl=max(settings.S3_PRESIGN_EXPIRES_SEC - settings.S3_PRESIGN_MIN_REMAINING_SEC, 0),
+)
+register_cache("presigned_urls", presigned_url_cache)
+
+
+def _sign_many(keys: List[str]) -> Dict[str, str]:
+    """Sign a batch of keys in one executor hop; keys that fail are left out."""
+    urls = {}
+    with s3_request_seconds.time(operation="presign_batch"):
+        for key in keys:
+            try:
+                urls[key] = get_presigned_url(key, expires_in=settings.S3_PRESIGN_EXPIRES_SEC)
+            except Exception as e:
+                print(f"Error generating URL for slip key {key}: {str(e)}")
+    return urls
+
+
+async def generate_presigned_urls(keys: List[str]) -> Dict[str, str]:
+    """
+    Presigned GET URLs for many keys, reusing cached URLs that are still valid
+
+    Args:
+        keys: S3 keys to sign
+
+    Returns:
+        Mapping of key -> URL (keys that could not be signed are omitted)
+    """
+    urls: Dict[str, str] = {}
+    misses: List[str] = []
+    for key in dict.fromkeys(keys):
+        url = presigned_url_cache.get(key)
+        if url is None:
+            misses.append(key)
+        else:
+            urls[key] = url
+
+    if misses:
+        loop = asyncio.get_running_loop()
+        signed = await loop.run_in_executor(None, _sign_many, misses)
+        for key, url in signed.items():
+            presigned_url_cache.set(key, url)
+        urls.update(signed)
+    return urls
+
+
+def generate_presigned_post(
+    key: str,
+    content_type: str,
+    max_bytes: int,
+    metadata: Optional[Dict[str, str]] = None,
+    expires_in: int = None,
+) -> dict:
+    """
+    Presigned POST so the browser uploads straight to S3
+
+    Args:
+        key: The S3 key the object must be stored under
+        content_type: The only Content-Type the upload may use
+        max_bytes: Upper bound enforced by S3 through content-length-range
+        metadata: x-amz-meta-* fields the upload must carry unchanged
+        expires_in: Seconds the form stays valid (default S3_UPLOAD_INTENT_EXPIRES_SEC)
+
+    Returns:
+        dict with "url" and "fields" for a multipart/form-data POST
+    """
+    fields = {"Content-Type": content_type}
+    for name, value in (metadata or {}).items():
+        fields[f"x-amz-meta-{name}"] = value
+    conditions = [{name: value} for name, value in fields.items()]
+    conditions.append(["content-length-range", 1, max_bytes])
+    try:
+        with s3_request_seconds.time(operation="presign_post"):
+            return s3_client.generate_presigned_post(
+                S3_BUCKET_NAME,
+                key,
+                Fields=fields,
+                Conditions=conditions,
+                ExpiresIn=expires_in or settings.S3_UPLOAD_INTENT_EXPIRES_SEC,
+            )
+    except Exception as e:
+        raise RuntimeError(f"Failed to generate presigned POST: {e}")
+
+
+def read_object_range(key: str, start: int, end: int) -> bytes:
+    """Read bytes [start, end] (inclusive) of an object without downloading all of it."""
+    try:
+        with s3_request_seconds.time(operation="get_object_range"):
+            response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=key, Range=f"bytes={start}-{end}")
+            return response["Body"].read()
+    except Exception as e:
+        raise RuntimeError(f"Failed to read object range: {e}")
+
+
 def delete_with_image_key(imageKey:str):
     """
         Delete Image from S3 with Image Key
     """
     try:
-        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=imageKey)
+        with s3_request_seconds.time(operation="delete_object"):
+            s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=imageKey)
         return {"message": f"Image '{imageKey}' deleted successfully from S3 bucket '{S3_BUCKET_NAME}'."}
     except ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchKey':
@@ -72,13 +220,69 @@ def delete_with_image_key(imageKey:str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
-def validate_images_exist(key: list[str]):
+# DeleteObjects accepts at most this many keys per request
+DELETE_OBJECTS_MAX_KEYS = 1000
+
+
+def delete_objects(keys: List[str]) -> Dict[str, str]:
+    """
+    Delete many objects with batched DeleteObjects calls (quiet mode)
+
+    Keys that do not exist count as deleted, so retrying a batch is safe.
+
+    Returns:
+        Mapping of key -> error code for every key S3 did not delete
+    """
+    failed: Dict[str, str] = {}
+    for start in range(0, len(keys), DELETE_OBJECTS_MAX_KEYS):
+        chunk = keys[start:start + DELETE_OBJECTS_MAX_KEYS]
+        try:
+            with s3_request_seconds.time(operation="delete_objects"):
+                response = s3_client.delete_objects(
+                    Bucket=S3_BUCKET_NAME,
+                    Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+                )
+        except ClientError as e:
+            failed.update(dict.fromkeys(chunk, e.response["Error"]["Code"]))
+            continue
+        except BotoCoreError as e:
+            failed.update(dict.fromkeys(chunk, type(e).__name__))
+            continue
+        for error in response.get("Errors", []):
+            failed[error["Key"]] = error.get("Code", "Unknown")
+    return failed
+
+def list_objects_page(
+    prefix: str = "",
+    start_after: Optional[str] = None,
+    continuation_token: Optional[str] = None,
+) -> dict:
+    """
+    One ListObjectsV2 page (up to 1000 keys, in UTF-8 binary key order)
+
+    Args:
+        prefix: Only keys under this prefix
+        start_after: Only keys strictly after this one (ignored with a continuation token)
+        continuation_token: NextContinuationToken of the previous page
+    """
+    kwargs = {"Bucket": S3_BUCKET_NAME, "Prefix": prefix}
+    if continuation_token:
+        kwargs["ContinuationToken"] = continuation_token
+    elif start_after:
+        kwargs["StartAfter"] = start_after
+    with s3_request_seconds.time(operation="list_objects"):
+        return s3_client.list_objects_v2(**kwargs)
+
+def validate_images_exist(key: str) -> dict:
     """
     ตรวจสอบว่า image_keys มีอยู่ใน S3
+
+    Returns:
+        The head_object response (ContentLength, ContentType, Metadata, ...)
     """
     try:
-        s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=key)  
-        return True   
+        with s3_request_seconds.time(operation="head_object"):
+            return s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=key)
     except ClientError as e:
         if e.response['Error']['Code'] == '404' or e.response['Error']['Code'] == 'NoSuchKey':
             raise HTTPException(
@@ -0,0 +1,360 @@
+"""
+Offline benchmark for the slip service
+
+Starts a fake auth service and the FastAPI app (S3, MongoDB and RabbitMQ
+replaced by the stand-ins in stubs.py) as separate processes, drives
+POST /api/slip/create and GET /api/slip/reservation/{id} at each concurrency
+level and image size, and writes throughput and latency percentiles to a JSON
+baseline. With --compare, exits non-zero when a result regressed past
+--max-regression against an earlier baseline.
+
+    python bench/run_bench.py --concurrency 1,8,32 --requests 200 \\
+        --image-sizes 800x600,1920x1080,4000x3000 --output bench/baseline.json
+
+    python bench/run_bench.py --compare bench/baseline.json --output /tmp/current.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+from stubs import BENCH_TOKEN, install_stubs, run_auth_server  # noqa: E402
+
+
+# -----------------------------------------------------------------------------
+# Processes
+# -----------------------------------------------------------------------------
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _app_env(args, auth_port: int) -> Dict[str, str]:
+    env = dict(os.environ)
+    in_memory = not args.mongo_url
+    env.update({
+        "PYTHONPATH": os.pathsep.join([REPO_ROOT, BENCH_DIR, env.get("PYTHONPATH", "")]),
+        "MONGO_SLIP_URL": args.mongo_url or "mongodb://in-memory",
+        "MONGO_DB": args.mongo_db,
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "REGION_NAME": "us-east-1",
+        "S3_BUCKET_NAME": "bench-slips",
+        "AUTH_SERVICE_URL": f"http://127.0.0.1:{auth_port}",
+        "AUTH_HEALTH_PROBE_PATH": "/health",
+        "RESERVATION_INDEX_ENABLED": "false",
+    })
+    if in_memory:
+        # mongomock has no transactions, which the outbox needs
+        env["SLIP_OUTBOX_ENABLED"] = "false"
+    return env
+
+
+def _start(args_list: List[str], env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), *args_list],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=None if os.getenv("BENCH_VERBOSE") else subprocess.DEVNULL,
+    )
+
+
+async def _wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def serve_app(args):
+    """Child process: the real app with stubbed downstreams."""
+    import uvicorn
+
+    app = install_stubs(args.s3_latency_ms, args.s3_mbps, args.broker_latency_ms, in_memory_mongo=not args.mongo_url)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, loop=args.loop, http=args.http, log_level="warning")
+
+
+# -----------------------------------------------------------------------------
+# Load
+# -----------------------------------------------------------------------------
+def _parse_size(text: str) -> Tuple[int, int]:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def _base_image(size: Tuple[int, int]) -> Image.Image:
+    """A gradient compresses like a photo of a slip far better than noise does."""
+    width, height = size
+    gradient = Image.linear_gradient("L").resize((width, height))
+    return Image.merge("RGB", (gradient, gradient.rotate(90, expand=False).resize((width, height)), gradient))
+
+
+def _unique_jpeg(base: Image.Image, n: int) -> bytes:
+    # A few changed pixels give every upload its own content hash, so the
+    # duplicate-upload short-circuit does not turn the run into cache hits
+    img = base.copy()
+    for i in range(8):
+        img.putpixel((i, 0), ((n >> (i * 3)) & 0xFF, n & 0xFF, i * 31))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _summarize(scenario: str, image: str, concurrency: int, latencies: List[float], errors: Dict[str, int], wall: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "scenario": scenario,
+        "image": image,
+        "concurrency": concurrency,
+        "requests": len(latencies) + sum(errors.values()),
+        "ok": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+        "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(_percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(_percentile(ordered, 99) * 1000, 2),
+    }
+
+
+async def _drive(concurrency: int, total: int, make_request) -> Tuple[List[float], Dict[str, int], float]:
+    """Run `total` requests with `concurrency` workers; make_request(i) returns the HTTP status."""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                status = await make_request(i)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            if status < 400:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run_load(args, base_url: str) -> List[dict]:
+    headers = {"Authorization": f"Bearer {BENCH_TOKEN}"}
+    connector = aiohttp.TCPConnector(limit=0)
+    results = []
+    run_id = int(time.time())
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+        for size_text in args.image_sizes.split(","):
+            base = _base_image(_parse_size(size_text))
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                prefix = f"bench-{run_id}-{size_text}-c{concurrency}"
+                # Pre-encode outside the timed loop; the client should not be the bottleneck
+                payloads = [_unique_jpeg(base, n) for n in range(args.requests)]
+                reservation_ids = [f"{prefix}-r{n % args.reservations}" for n in range(args.requests)]
+
+                async def create(i: int) -> int:
+                    form = aiohttp.FormData()
+                    form.add_field("reservationId", reservation_ids[i])
+                    form.add_field("marketId", "bench-market")
+                    form.add_field("slipFile", payloads[i], filename=f"slip-{i}.jpg", content_type="image/jpeg")
+                    async with session.post(f"{base_url}/api/slip/create", data=form) as resp:
+                        await resp.read()
+                        return resp.status
+
+                latencies, errors, wall = await _drive(concurrency, args.requests, create)
+                results.append(_summarize("create", size_text, concurrency, latencies, errors, wall))
+                _print_result(results[-1])
+
+                async def list_slips(i: int) -> int:
+                    url = f"{base_url}/api/slip/reservation/{reservation_ids[i % len(reservation_ids)]}"
+                    async with session.get(url) as resp:
+                        await resp.read()
+                        return resp.status
+
+                latencies, errors, wall = await _drive(concurrency, args.requests, list_slips)
+                results.append(_summarize("list", size_text, concurrency, latencies, errors, wall))
+                _print_result(results[-1])
+    return results
+
+
+def _print_result(result: dict):
+    print(
+        f"{result['scenario']:>6} {result['image']:>10} c={result['concurrency']:<4} "
+        f"{result['throughput_rps']:>8.1f} req/s  p50 {result['p50_ms']:>8.1f} ms  "
+        f"p95 {result['p95_ms']:>8.1f} ms  p99 {result['p99_ms']:>8.1f} ms  errors {result['errors'] or '-'}"
+    )
+
+
+# -----------------------------------------------------------------------------
+# Baseline
+# -----------------------------------------------------------------------------
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(previous: dict, current: dict, max_regression: float) -> List[str]:
+    """Describe every result whose p95 rose or throughput fell by more than max_regression."""
+    key = lambda r: (r["scenario"], r["image"], r["concurrency"])
+    before = {key(r): r for r in previous.get("results", [])}
+    problems = []
+    for result in current["results"]:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        name = "{} {} c={}".format(*key(result))
+        if old["p95_ms"] and result["p95_ms"] > old["p95_ms"] * (1 + max_regression):
+            problems.append(f"{name}: p95 {old['p95_ms']} -> {result['p95_ms']} ms")
+        if old["throughput_rps"] and result["throughput_rps"] < old["throughput_rps"] * (1 - max_regression):
+            problems.append(f"{name}: throughput {old['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if result["errors"] and not old["errors"]:
+            problems.append(f"{name}: errors {result['errors']}")
+    return problems
+
+
+async def run(args) -> int:
+    auth_port = _free_port()
+    app_port = _free_port()
+    auth = _start(["auth", "--port", str(auth_port), "--auth-latency-ms", str(args.auth_latency_ms)])
+    app = _start(
+        [
+            "app",
+            "--port", str(app_port),
+            "--s3-latency-ms", str(args.s3_latency_ms),
+            "--s3-mbps", str(args.s3_mbps),
+            "--broker-latency-ms", str(args.broker_latency_ms),
+            "--loop", args.loop,
+            "--http", args.http,
+        ] + (["--mongo-url", args.mongo_url] if args.mongo_url else []),
+        env=_app_env(args, auth_port),
+    )
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        await _wait_ready(f"http://127.0.0.1:{auth_port}/health")
+        await _wait_ready(f"{base_url}/metrics")
+        results = await run_load(args, base_url)
+    finally:
+        for process in (app, auth):
+            process.terminate()
+        for process in (app, auth):
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "options": {
+                name: getattr(args, name)
+                for name in (
+                    "concurrency", "requests", "reservations", "image_sizes", "auth_latency_ms",
+                    "s3_latency_ms", "s3_mbps", "broker_latency_ms", "loop", "http",
+                )
+            },
+            "mongo": "external" if args.mongo_url else "in-memory",
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous.get("meta", {}).get("options") != report["meta"]["options"]:
+            print("Warning: baseline was recorded with different options; comparing matching results anyway")
+        problems = compare(previous, report, args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            return 1
+        print(f"No regressions beyond {args.max_regression:.0%} against {args.compare}")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the slip service")
+    commands = parser.add_subparsers(dest="command")
+
+    bench = commands.add_parser("run", help="Run the benchmark (default)")
+    for target in (parser, bench):
+        target.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+        target.add_argument("--requests", type=int, default=200, help="Requests per scenario and level")
+        target.add_argument("--reservations", type=int, default=20, help="Distinct reservations the uploads spread over")
+        target.add_argument("--image-sizes", default="800x600,1920x1080,4000x3000", help="Comma-separated WxH")
+        target.add_argument("--auth-latency-ms", type=float, default=5)
+        target.add_argument("--s3-latency-ms", type=float, default=20)
+        target.add_argument("--s3-mbps", type=float, default=100, help="Emulated S3 upload bandwidth")
+        target.add_argument("--broker-latency-ms", type=float, default=2)
+        target.add_argument("--mongo-url", default=None, help="Use a real MongoDB instead of the in-memory one")
+        target.add_argument("--mongo-db", default="slip_bench")
+        target.add_argument("--loop", default="uvloop")
+        target.add_argument("--http", default="httptools")
+        target.add_argument("--output", default=os.path.join(BENCH_DIR, "baseline.json"))
+        target.add_argument("--compare", default=None, help="Earlier baseline to check for regressions")
+        target.add_argument("--max-regression", type=float, default=0.15, help="Allowed p95/throughput change (0.15 = 15%%)")
+
+    auth = commands.add_parser("auth", help=argparse.SUPPRESS)
+    auth.add_argument("--port", type=int, required=True)
+    auth.add_argument("--auth-latency-ms", type=float, default=5)
+
+    app = commands.add_parser("app", help=argparse.SUPPRESS)
+    app.add_argument("--port", type=int, required=True)
+    app.add_argument("--s3-latency-ms", type=float, default=20)
+    app.add_argument("--s3-mbps", type=float, default=100)
+    app.add_argument("--broker-latency-ms", type=float, default=2)
+    app.add_argument("--mongo-url", default=None)
+    app.add_argument("--loop", default="uvloop")
+    app.add_argument("--http", default="httptools")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "auth":
+        run_auth_server(args.port, args.auth_latency_ms)
+    elif args.command == "app":
+        serve_app(args)
+    else:
+        sys.exit(asyncio.run(run(args)))
@@ -0,0 +1,201 @@
+"""
+Local stand-ins for every downstream of the slip service, used by run_bench.py
+
+- fake auth service (aiohttp) serving /users/info and /users/verify
+- in-process S3 emulator replacing app.utils.s3.s3_client
+- in-memory MongoDB (mongomock-motor) unless a real MONGO_SLIP_URL is given
+- stub RabbitMQ exchange that "confirms" every publish after a fixed latency
+"""
+import asyncio
+import hashlib
+import io
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from aiohttp import web
+
+BENCH_TOKEN = "bench-token"
+BENCH_USER_ID = "bench-vendor"
+BENCH_ROLE = "vendor"
+
+
+# -----------------------------------------------------------------------------
+# Fake auth service
+# -----------------------------------------------------------------------------
+def make_auth_app(latency_ms: float) -> web.Application:
+    delay = latency_ms / 1000
+
+    async def users_info(request: web.Request) -> web.Response:
+        await asyncio.sleep(delay)
+        if request.headers.get("Authorization", "") != f"Bearer {BENCH_TOKEN}":
+            return web.json_response({"detail": "Invalid token"}, status=401)
+        return web.json_response({"id": BENCH_USER_ID, "role": BENCH_ROLE})
+
+    async def users_verify(request: web.Request) -> web.Response:
+        await asyncio.sleep(delay)
+        body = await request.json()
+        return web.json_response({"verify": body.get("required_role") == BENCH_ROLE})
+
+    async def health(_request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    app = web.Application()
+    app.router.add_get("/users/info", users_info)
+    app.router.add_post("/users/verify", users_verify)
+    app.router.add_get("/health", health)
+    return app
+
+
+def run_auth_server(port: int, latency_ms: float):
+    web.run_app(make_auth_app(latency_ms), host="127.0.0.1", port=port, print=None)
+
+
+# -----------------------------------------------------------------------------
+# In-process S3 emulator
+# -----------------------------------------------------------------------------
+class _NoSuchKey(Exception):
+    pass
+
+
+class FakeS3Client:
+    """
+    The subset of the boto3 S3 client app.utils.s3 uses, backed by a dict
+
+    Every call sleeps `latency_ms`; uploads additionally take size / `mbps`.
+    Objects are kept in memory, so keep benchmark runs to a sensible size.
+    """
+
+    def __init__(self, latency_ms: float = 20, mbps: float = 100):
+        self.latency = latency_ms / 1000
+        self.bytes_per_sec = mbps * 1024 * 1024
+        self.objects: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _client_error(self, code: str):
+        from botocore.exceptions import ClientError
+        return ClientError({"Error": {"Code": code, "Message": code}}, "HeadObject")
+
+    def upload_fileobj(self, file_obj, bucket, key, ExtraArgs=None, Config=None):
+        data = file_obj.read()
+        time.sleep(self.latency + len(data) / self.bytes_per_sec)
+        with self._lock:
+            self.objects[key] = {
+                "Body": data,
+                "ContentType": (ExtraArgs or {}).get("ContentType", "binary/octet-stream"),
+                "ETag": hashlib.md5(data).hexdigest(),
+                "Metadata": {},
+                "LastModified": datetime.now(timezone.utc),
+            }
+
+    def head_object(self, Bucket, Key):
+        time.sleep(self.latency)
+        obj = self.objects.get(Key)
+        if obj is None:
+            raise self._client_error("404")
+        return {
+            "ContentLength": len(obj["Body"]),
+            "ContentType": obj["ContentType"],
+            "ETag": obj["ETag"],
+            "Metadata": obj["Metadata"],
+        }
+
+    def get_object(self, Bucket, Key, Range: Optional[str] = None):
+        time.sleep(self.latency)
+        obj = self.objects.get(Key)
+        if obj is None:
+            raise self._client_error("NoSuchKey")
+        data = obj["Body"]
+        if Range:
+            start, end = Range.split("=", 1)[1].split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def delete_object(self, Bucket, Key):
+        time.sleep(self.latency)
+        with self._lock:
+            self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        time.sleep(self.latency)
+        with self._lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop(obj["Key"], None)
+        return {} if Delete.get("Quiet") else {"Deleted": Delete["Objects"]}
+
+    def list_objects_v2(self, Bucket, Prefix="", StartAfter=None, ContinuationToken=None, MaxKeys=1000):
+        time.sleep(self.latency)
+        after = ContinuationToken or StartAfter or ""
+        with self._lock:
+            keys = sorted(key for key in self.objects if key.startswith(Prefix) and key > after)
+        page = keys[:MaxKeys]
+        response = {
+            "Contents": [
+                {"Key": key, "Size": len(self.objects[key]["Body"]), "LastModified": self.objects[key]["LastModified"]}
+                for key in page
+            ],
+            "IsTruncated": len(keys) > MaxKeys,
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600):
+        # Signing is local CPU work in boto3 too: no latency
+        return f"http://fake-s3.local/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600):
+        return {"url": f"http://fake-s3.local/{Bucket}/", "fields": {"key": Key, **(Fields or {})}}
+
+
+# -----------------------------------------------------------------------------
+# Stub broker
+# -----------------------------------------------------------------------------
+class StubExchange:
+    """Stands in for an aio-pika exchange on a confirm-mode channel."""
+
+    def __init__(self, name: str, latency_ms: float):
+        self.name = name
+        self.delay = latency_ms / 1000
+        self.published = 0
+
+    async def publish(self, message, routing_key: str, timeout: Optional[float] = None):
+        await asyncio.sleep(self.delay)
+        self.published += 1
+
+
+# -----------------------------------------------------------------------------
+# Wiring
+# -----------------------------------------------------------------------------
+def install_stubs(s3_latency_ms: float, s3_mbps: float, broker_latency_ms: float, in_memory_mongo: bool):
+    """
+    Patch the service modules to use the stand-ins. Must run after the app
+    settings are in the environment and before the app starts serving.
+    """
+    import main
+    import app.utils.s3 as s3
+    import app.messaging.rabbitmq as rabbitmq
+
+    if in_memory_mongo:
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+    s3.s3_client = FakeS3Client(latency_ms=s3_latency_ms, mbps=s3_mbps)
+
+    exchanges: Dict[str, StubExchange] = {}
+
+    async def _get_exchange(exchange_name: str) -> StubExchange:
+        exchange = exchanges.get(exchange_name)
+        if exchange is None:
+            exchange = exchanges[exchange_name] = StubExchange(exchange_name, broker_latency_ms)
+        return exchange
+
+    async def _no_topology():
+        pass
+
+    rabbitmq._get_exchange = _get_exchange
+    main.setup_rabbitmq = _no_topology
+    return main.app
@@ -1,15 +1,49 @@
  
+import argparse
 import asyncio
+import json
+import logging
+import os
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from app.routes.slip_router import router as slip_router
 from app.db.mongo import close_mongo_connection, connect_to_mongo
-from app.messaging.rabbitmq import get_rabbitmq_connection
+from app.db.indexes import ensure_indexes, verify_query_plans
+from app.db.reconcile import reconcile
+from app.crud import close_slip_writer, close_slip_cache, get_slip_cache_stats
+from app.db.retention import (
+    start_retention_sweeper,
+    stop_retention_sweeper,
+    sweep_retention,
+    get_retention_stats,
+)
+from app.messaging.outbox import start_outbox_relay, stop_outbox_relay, get_outbox_stats
+from app.messaging.reservation_index import (
+    start_reservation_consumer,
+    stop_reservation_consumer,
+    get_reservation_index_stats,
+)
+from app.messaging.rabbitmq import get_rabbitmq_connection, close_rabbitmq_connection
+from app.auth.auth import (
+    init_auth_client,
+    close_auth_client,
+    get_auth_cache_stats,
+    get_auth_endpoint_state,
+    load_jwt_keys,
+    start_auth_health_prober,
+    stop_auth_health_prober,
+)
 from app.core.config import settings
+from app.utils.s3 import shutdown_s3_executor, presigned_url_cache
+from app.core.image_check import shutdown_image_pool, get_image_pool_stats, MAX_BYTES
+from app.utils.admission import UploadAdmissionMiddleware, get_admission_stats, drain_limiters
+from app.utils.metrics import MetricsMiddleware, render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 import aio_pika
 
+logger = logging.getLogger(__name__)
+
 async def setup_rabbitmq():
     connection = await get_rabbitmq_connection()
     channel = await connection.channel()
@@ -28,16 +62,58 @@ async def setup_rabbitmq():
 
     # bind queue กับ exchange ตาม routing key
     await queue.bind(exchange, routing_key="reservation.status")
+    # Topology only; publishing uses the pooled channels in app.messaging.rabbitmq
+    await channel.close()
 
     print("✅ RabbitMQ exchange & queue created and bound successfully!")
 
+async def prepare_indexes(verify_plans: bool = False):
+    try:
+        await ensure_indexes()
+        if verify_plans:
+            await verify_query_plans()
+    except Exception as e:
+        logger.error("Index preparation failed: %s", e)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Runs once per worker process, so every worker opens its own pools
     # Startup
     await connect_to_mongo()
+    # Built in the background so startup does not wait on large collections
+    index_task = None
+    if settings.MONGO_ENSURE_INDEXES:
+        index_task = asyncio.create_task(prepare_indexes(settings.MONGO_VERIFY_QUERY_PLANS))
     await setup_rabbitmq()
+    if settings.RESERVATION_INDEX_ENABLED:
+        await start_reservation_consumer()
+    load_jwt_keys()
+    await init_auth_client()
+    start_auth_health_prober()
+    if settings.SLIP_OUTBOX_ENABLED:
+        if settings.MONGO_GROUP_COMMIT:
+            logger.warning("MONGO_GROUP_COMMIT has no effect while SLIP_OUTBOX_ENABLED: slips are written in outbox transactions")
+        start_outbox_relay()
+    if settings.SLIP_RETENTION_ENABLED:
+        start_retention_sweeper()
     yield
-    # Shutdown
+    # Shutdown: uvicorn has stopped accepting connections and drained in-flight requests
+    # (up to SERVER_GRACEFUL_TIMEOUT_SEC). Stop background work, flush, then close pools.
+    await stop_reservation_consumer()
+    await stop_outbox_relay(timeout=settings.SHUTDOWN_DRAIN_TIMEOUT_SEC)
+    await stop_retention_sweeper(timeout=settings.SHUTDOWN_DRAIN_TIMEOUT_SEC)
+    await stop_auth_health_prober()
+    if index_task is not None and not index_task.done():
+        index_task.cancel()
+    await close_slip_writer()
+    idle = await drain_limiters(("s3", "mongo", "broker"), settings.SHUTDOWN_DRAIN_TIMEOUT_SEC)
+    if not all(idle.values()):
+        logger.warning("Shutting down with downstream calls still in flight: %s", idle)
+    await close_rabbitmq_connection()
+    await close_auth_client()
+    shutdown_s3_executor()
+    shutdown_image_pool()
+    await close_slip_cache()
     close_mongo_connection()
     
 app = FastAPI(title="Eiei Slip Management", lifespan=lifespan)
@@ -45,6 +121,12 @@ list = [
        
         "http://localhost:3000"
 ]
+# Reject oversized or excess uploads before their body is read (added first so CORS wraps its 503s)
+app.add_middleware(
+    UploadAdmissionMiddleware,
+    paths=["/api/slip/create"],
+    max_body_bytes=MAX_BYTES + settings.ADMISSION_BODY_OVERHEAD_BYTES,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000",settings.FRONTEND_URL],       
@@ -52,21 +134,126 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],          
     allow_headers=["*"],          
 )
+# Outermost: times every request (including rejected uploads) and adds Server-Timing
+app.add_middleware(MetricsMiddleware)
  
  
 
 app.include_router(slip_router, prefix="/api/slip", tags=["Reservations"])
 
 
-async def serve_fastapi():
-    config = uvicorn.Config(app, host="0.0.0.0", port=7004)
-    server = uvicorn.Server(config)
-    await server.serve()
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text format; per worker process."""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/internal/stats", include_in_schema=False)
+async def internal_stats():
+    return {
+        "auth": get_auth_cache_stats(),
+        "auth_endpoints": get_auth_endpoint_state(),
+        "presigned_urls": presigned_url_cache.stats(),
+        "slips": get_slip_cache_stats(),
+        "outbox": get_outbox_stats(),
+        "reservation_index": get_reservation_index_stats(),
+        "image_validation": get_image_pool_stats(),
+        "admission": get_admission_stats(),
+        "retention": get_retention_stats(),
+    }
+
+
+def serve(workers: int):
+    """
+    Run the API server with uvloop and httptools
+
+    With more than one worker uvicorn forks a supervisor plus `workers`
+    processes sharing the port; each imports this module and runs its own
+    lifespan. SIGTERM drains in-flight requests before the lifespan shutdown.
+    """
+    workers = workers or os.cpu_count() or 1
+    options = dict(
+        host=settings.SERVER_HOST,
+        port=settings.SERVER_PORT,
+        loop=settings.SERVER_LOOP,
+        http=settings.SERVER_HTTP,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT_SEC,
+    )
+    if workers > 1:
+        # Workers are separate processes and need an import string; they read the
+        # resolved count from the environment (e.g. to cap the local slip cache TTL)
+        os.environ["SERVER_WORKERS"] = str(workers)
+        uvicorn.run("main:app", workers=workers, **options)
+    else:
+        uvicorn.run(app, **options)
     
-async def main():
-    await asyncio.gather(
-        serve_fastapi(),
+async def run_index_command(verify_plans: bool):
+    """One-shot index build (and optional plan check) without starting the server."""
+    await connect_to_mongo()
+    try:
+        await ensure_indexes()
+        if verify_plans:
+            for name, stages in (await verify_query_plans()).items():
+                print(f"{name}: {' -> '.join(stages)}")
+    finally:
+        close_mongo_connection()
+
+async def run_retention_command(dry_run: bool, max_batches: int):
+    """One retention pass from the command line; resumes an interrupted run."""
+    await connect_to_mongo()
+    try:
+        summary = await sweep_retention(dry_run=dry_run, max_batches=max_batches)
+        print(json.dumps(summary, indent=2))
+    finally:
+        await stop_retention_sweeper()
+        shutdown_s3_executor()
+        close_mongo_connection()
+
+async def run_reconcile_command(delete_orphans: bool, delete_records: bool, partitions: int, report_path: str):
+    """Reconcile S3 against the slips collection once and print the totals (report-only by default)."""
+    await connect_to_mongo()
+    report = open(report_path, "w") if report_path else None
+    try:
+        summary = await reconcile(delete_orphans=delete_orphans, delete_records=delete_records, partitions=partitions, report=report)
+        print(json.dumps(summary, indent=2))
+    finally:
+        if report is not None:
+            report.close()
+        shutdown_s3_executor()
+        close_mongo_connection()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Eiei Slip Management")
+    commands = parser.add_subparsers(dest="command")
+    server = commands.add_parser("serve", help="Run the API server (default)")
+    server.add_argument(
+        "--workers",
+        type=int,
+        default=settings.SERVER_WORKERS,
+        help="Worker processes; 0 = one per CPU core (default: SERVER_WORKERS)",
     )
+    indexes = commands.add_parser("ensure-indexes", help="Build missing MongoDB indexes and exit")
+    indexes.add_argument("--explain", action="store_true", help="Also explain() hot queries and warn on COLLSCAN")
+    retention = commands.add_parser("sweep-retention", help="Delete expired slips and their S3 objects, then exit")
+    retention.add_argument("--dry-run", action="store_true", help="Only count what would be deleted")
+    retention.add_argument("--max-batches", type=int, default=None, help="Stop after this many batches (resumable)")
+    reconcile_parser = commands.add_parser("reconcile", help="Report S3 objects and slip records without a counterpart")
+    reconcile_parser.add_argument("--delete-orphans", action="store_true", help="Delete orphan S3 objects")
+    reconcile_parser.add_argument("--delete-records", action="store_true", help="Also delete slip records whose image is missing")
+    reconcile_parser.add_argument("--partitions", type=int, default=None, help="Key-range partitions (default: RECONCILE_PARTITIONS)")
+    reconcile_parser.add_argument("--report", default=None, help="Write every orphan as a JSON line to this file")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    args = parse_args()
+    if args.command == "ensure-indexes":
+        logging.basicConfig(level=logging.INFO)
+        asyncio.run(run_index_command(args.explain))
+    elif args.command == "sweep-retention":
+        logging.basicConfig(level=logging.INFO)
+        asyncio.run(run_retention_command(args.dry_run, args.max_batches))
+    elif args.command == "reconcile":
+        logging.basicConfig(level=logging.INFO)
+        asyncio.run(run_reconcile_command(args.delete_orphans, args.delete_records, args.partitions, args.report))
+    else:
+        serve(getattr(args, "workers", settings.SERVER_WORKERS))
\ No newline at end of file
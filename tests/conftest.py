@@ -0,0 +1,13 @@
+import os
+
+# Settings are read at import time; tests never reach these services
+for name, value in {
+    "MONGO_SLIP_URL": "mongodb://localhost:27017",
+    "MONGO_DB": "slip_test",
+    "AWS_ACCESS_KEY_ID": "test",
+    "AWS_SECRET_ACCESS_KEY": "test",
+    "REGION_NAME": "us-east-1",
+    "S3_BUCKET_NAME": "slip-test",
+    "AUTH_SERVICE_URL": "http://auth.test",
+}.items():
+    os.environ.setdefault(name, value)
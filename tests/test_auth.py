@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jose import jwk, jwt
+
+from app.auth import auth
+from app.utils.admission import Overloaded
+
+KID = "rsa-1"
+
+
+@pytest.fixture
+def rsa_jwks(monkeypatch):
+    """Local verification against a JWKS holding one RSA key; returns its private PEM."""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    public_jwk = {**jwk.construct(public_pem, "RS256").to_dict(), "kid": KID}
+
+    monkeypatch.setattr(auth, "AUTH_VERIFY_MODE", "local")
+    monkeypatch.setattr(auth, "AUTH_JWT_JWKS_FILE", "jwks.json")
+    monkeypatch.setattr(auth, "AUTH_JWT_ALGORITHMS", ["HS256", "RS256"])
+    monkeypatch.setattr(auth, "_jwks", {KID: public_jwk})
+    monkeypatch.setattr(auth, "_jwks_loaded_at", time.monotonic())
+    return private_pem
+
+
+def _claims():
+    return {"sub": "vendor-1", "role": "vendor", "exp": int(time.time()) + 300}
+
+
+def test_valid_rs256_token_is_accepted(rsa_jwks):
+    token = jwt.encode(_claims(), rsa_jwks, algorithm="RS256", headers={"kid": KID})
+    user = auth._verify_locally(token)
+    assert user.user_id == "vendor-1"
+    assert user.role == "vendor"
+
+
+def test_hs256_token_with_rsa_kid_is_401(rsa_jwks):
+    # Used to reach jose.jwk.construct with an RSA JWK and alg=HS256 -> JWKError -> 500
+    token = jwt.encode(_claims(), "attacker-secret", algorithm="HS256", headers={"kid": KID})
+    with pytest.raises(HTTPException) as exc:
+        auth._verify_locally(token)
+    assert exc.value.status_code == 401
+
+
+def test_algorithm_outside_allow_list_is_401(rsa_jwks, monkeypatch):
+    monkeypatch.setattr(auth, "AUTH_JWT_ALGORITHMS", ["RS256"])
+    token = jwt.encode(_claims(), "attacker-secret", algorithm="HS512", headers={"kid": KID})
+    with pytest.raises(HTTPException) as exc:
+        auth._verify_locally(token)
+    assert exc.value.status_code == 401
+
+
+def test_expired_token_is_401(rsa_jwks):
+    claims = {**_claims(), "exp": int(time.time()) - 10}
+    token = jwt.encode(claims, rsa_jwks, algorithm="RS256", headers={"kid": KID})
+    with pytest.raises(HTTPException) as exc:
+        auth._verify_locally(token)
+    assert exc.value.status_code == 401
+
+
+def test_bypass_does_not_swallow_load_shedding(monkeypatch):
+    monkeypatch.setattr(auth, "BYPASS_AUTH", True)
+    monkeypatch.setattr(auth, "_verify_locally", lambda token: None)
+
+    async def overloaded(token):
+        raise Overloaded("auth", 2)
+
+    async def unavailable(token):
+        raise HTTPException(status_code=503, detail="Authentication service is currently unavailable")
+
+    monkeypatch.setattr(auth, "_fetch_user_info", overloaded)
+    with pytest.raises(Overloaded) as exc:
+        asyncio.run(auth.get_user_from_token("token-a"))
+    assert exc.value.headers["Retry-After"] == "2"
+
+    monkeypatch.setattr(auth, "_fetch_user_info", unavailable)
+    assert asyncio.run(auth.get_user_from_token("token-b")).user_id == "dev-user"
+
+
+@pytest.mark.parametrize("status,healthy", [(200, True), (204, True), (401, True), (403, True), (404, False), (400, False), (502, False)])
+def test_only_success_and_auth_decisions_mark_an_endpoint_healthy(status, healthy):
+    assert auth._answered_properly(status) is healthy
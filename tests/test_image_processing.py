@@ -0,0 +1,43 @@
+import io
+
+import pytest
+from PIL import Image
+from pydantic import ValidationError
+
+from app.core.config import Settings
+from app.core.image_processing import normalize_image
+
+
+def _png(img: Image.Image) -> bytes:
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("fmt", ["WEBP", "JPEG"])
+def test_sixteen_bit_png_is_scaled_not_rejected(fmt):
+    grey = Image.new("I;16", (64, 32), 40000)
+    result = normalize_image(_png(grey), fmt, 80, 2048, 16)
+
+    with Image.open(io.BytesIO(result.data)) as img:
+        assert img.size == (64, 32)
+        # 40000 / 256 = 156: scaled to 8 bits, not clipped to white
+        assert abs(img.convert("L").getpixel((0, 0)) - 156) <= 2
+    with Image.open(io.BytesIO(result.thumbnail)) as thumb:
+        assert max(thumb.size) == 16
+
+
+def test_cmyk_image_is_converted():
+    cmyk = Image.new("CMYK", (20, 20), (0, 255, 255, 0))
+    out = io.BytesIO()
+    cmyk.save(out, format="JPEG")
+    result = normalize_image(out.getvalue(), "WEBP", 80, 2048, 16)
+    assert result.content_type == "image/webp"
+
+
+def test_output_format_is_checked_when_settings_load(monkeypatch):
+    monkeypatch.setenv("IMAGE_OUTPUT_FORMAT", "jpeg")
+    assert Settings().IMAGE_OUTPUT_FORMAT == "JPEG"
+    monkeypatch.setenv("IMAGE_OUTPUT_FORMAT", "gif")
+    with pytest.raises(ValidationError):
+        Settings()
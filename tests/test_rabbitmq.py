@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+from app.messaging import rabbitmq
+
+
+class FakeExchange:
+    """Confirms each publish after `delay`; fails the ones whose body says so."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.sent = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def publish(self, message, routing_key, timeout=None):
+        body = json.loads(message.body)
+        self.sent.append(body["n"])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if body.get("fail"):
+            raise RuntimeError("nacked")
+
+
+def test_publish_batch_pipelines_in_order(monkeypatch):
+    exchange = FakeExchange()
+
+    async def get_exchange(name):
+        return exchange
+
+    monkeypatch.setattr(rabbitmq, "_get_exchange", get_exchange)
+    messages = [{"n": n, "fail": n == 2} for n in range(5)]
+    errors = asyncio.run(rabbitmq.publish_batch("vendor_reservation", "reservation.status", messages))
+
+    assert exchange.sent == [0, 1, 2, 3, 4]
+    assert exchange.max_in_flight == 5
+    assert [error is not None for error in errors] == [False, False, True, False, False]
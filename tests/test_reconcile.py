@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from app.db import reconcile
+from app.db.reconcile import PartitionResult, _Reconciler, is_slip_object_key
+
+OLD = datetime.now(timezone.utc) - timedelta(days=7)
+NEW = datetime.now(timezone.utc)
+HASH = "ab" * 32
+UUID_KEY = "0f8fad5b-d9cb-469f-a165-70867728950e_1700000000.0_slip.jpg"
+
+
+def _old_id() -> ObjectId:
+    return ObjectId.from_datetime(OLD)
+
+
+async def _stream(items):
+    for item in items:
+        yield item
+
+
+def _join(objects, records, thumbnails=False, delete_orphans=False):
+    async def run():
+        reconciler = _Reconciler(delete_orphans=delete_orphans, delete_records=False, report=None)
+        result = PartitionResult(None, None)
+        await reconciler.merge_join(result, _stream(sorted(objects)), _stream(sorted(records)), thumbnails)
+        return result
+
+    return asyncio.run(run())
+
+
+def test_slip_key_shapes():
+    assert is_slip_object_key(f"res-1/{HASH}.jpg")
+    assert is_slip_object_key(f"res-1/{HASH}")
+    assert is_slip_object_key(UUID_KEY)
+    assert is_slip_object_key(f"thumbnails/res-1/{HASH}.webp")
+    assert not is_slip_object_key("other-service/logo.png")
+    assert not is_slip_object_key(f"res-1/nested/{HASH}.jpg")
+    assert not is_slip_object_key("backup.tar.gz")
+
+
+def test_foreign_keys_are_never_orphans():
+    result = _join([("other-service/logo.png", OLD), ("zzz.txt", OLD)], [])
+    assert result.foreign_objects == 2
+    assert result.orphan_objects == 0
+    assert result.samples == []
+
+
+def test_foreign_shaped_object_still_matches_its_record():
+    key = "legacy-key.jpg"
+    result = _join([(key, OLD)], [(key, _old_id())])
+    assert result.missing_objects == 0
+    assert result.orphan_objects == 0
+
+
+def test_orphans_and_missing_objects_are_reported():
+    orphan = f"res-1/{HASH}.jpg"
+    missing = f"res-2/{HASH}.jpg"
+    result = _join([(orphan, OLD)], [(missing, _old_id())])
+    assert result.orphan_objects == 1
+    assert result.missing_objects == 1
+    assert {sample["type"] for sample in result.samples} == {"orphan_object", "missing_object"}
+
+
+def test_grace_window_protects_recent_objects_and_records():
+    recent_object = f"res-1/{HASH}.jpg"
+    recent_record = f"res-2/{HASH}.jpg"
+    result = _join([(recent_object, NEW)], [(recent_record, ObjectId())])
+    assert result.orphan_objects == 0
+    assert result.missing_objects == 0
+
+
+def test_records_sharing_an_object_all_match():
+    key = f"res-1/{HASH}.jpg"
+    result = _join([(key, OLD)], [(key, _old_id()), (key, _old_id())])
+    assert result.records == 2
+    assert result.missing_objects == 0
+    assert result.orphan_objects == 0
+
+
+def test_missing_thumbnails_are_reported_separately():
+    result = _join([], [(f"thumbnails/res-1/{HASH}.webp", _old_id())], thumbnails=True)
+    assert result.missing_thumbnails == 1
+    assert result.missing_objects == 0
+
+
+def test_orphans_are_deleted_only_when_asked(monkeypatch):
+    deleted = []
+    monkeypatch.setattr(reconcile, "delete_objects", lambda keys: deleted.extend(keys) or {})
+    orphan = f"res-1/{HASH}.jpg"
+    objects = [(orphan, OLD), ("other-service/logo.png", OLD)]
+
+    result = _join(objects, [])
+    assert result.orphan_objects == 1 and result.deleted_objects == 0
+    assert deleted == []
+
+    result = _join(objects, [], delete_orphans=True)
+    assert result.deleted_objects == 1
+    assert deleted == [orphan]
@@ -0,0 +1,69 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+from app.core.config import settings
+from app.messaging import reservation_index
+
+
+class FakeMessage:
+    """The part of an aio-pika incoming message _on_message uses."""
+
+    def __init__(self, event):
+        self.body = json.dumps(event).encode()
+        self.outcome = None
+
+    async def ack(self):
+        self.outcome = "ack"
+
+    async def nack(self, requeue=True):
+        self.outcome = "requeue" if requeue else "nack"
+
+    async def reject(self, requeue=False):
+        self.outcome = "requeue" if requeue else "reject"
+
+    @asynccontextmanager
+    async def process(self, requeue=False, ignore_processed=False):
+        try:
+            yield
+        except Exception:
+            await self.reject(requeue=requeue)
+            raise
+        if self.outcome is None:
+            await self.ack()
+
+
+def test_failing_write_backs_off_then_rejects(monkeypatch):
+    delays = []
+
+    async def failing_apply(event):
+        raise RuntimeError("mongo down")
+
+    async def record_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(reservation_index, "apply_event", failing_apply)
+    monkeypatch.setattr(reservation_index.asyncio, "sleep", record_sleep)
+    monkeypatch.setattr(reservation_index, "_consecutive_failures", 0)
+    monkeypatch.setattr(settings, "RESERVATION_CONSUMER_MAX_ATTEMPTS", 3)
+
+    async def deliver():
+        message = FakeMessage({"reservationId": "res-1", "status": "CONFIRMED"})
+        await reservation_index._on_message(message)
+        return message.outcome
+
+    outcomes = [asyncio.run(deliver()) for _ in range(3)]
+    assert outcomes == ["requeue", "requeue", "reject"]
+    assert delays == [0.5, 1.0]
+
+
+def test_success_resets_backoff(monkeypatch):
+    async def apply(event):
+        return True
+
+    monkeypatch.setattr(reservation_index, "apply_event", apply)
+    monkeypatch.setattr(reservation_index, "_consecutive_failures", 4)
+    message = FakeMessage({"reservationId": "res-2"})
+    asyncio.run(reservation_index._on_message(message))
+    assert message.outcome == "ack"
+    assert reservation_index._consecutive_failures == 0
@@ -0,0 +1,54 @@
+import asyncio
+
+from app import crud
+
+
+def _run(coro):
+    async def run():
+        await crud.slip_cache.close()
+        return await coro()
+
+    return asyncio.run(run())
+
+
+def test_invalidation_during_load_is_not_cached():
+    async def scenario():
+        started = asyncio.Event()
+        release = asyncio.Event()
+        loads = []
+
+        async def load():
+            loads.append(1)
+            started.set()
+            await release.wait()
+            return {"version": len(loads)}
+
+        first = asyncio.create_task(crud._cached_read("slip:a", load, lambda value: False))
+        await started.wait()
+        await crud._invalidate_slip_cache(["a"])
+        release.set()
+        assert await first == {"version": 1}
+        # The stale load was not cached: the next read loads again
+        assert await crud._cached_read("slip:a", load, lambda value: False) == {"version": 2}
+        assert await crud._cached_read("slip:a", load, lambda value: False) == {"version": 2}
+        assert len(loads) == 2
+
+    _run(scenario)
+
+
+def test_invalidation_leaves_other_keys_filling():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def load():
+            await release.wait()
+            return {"id": "b"}
+
+        pending = asyncio.create_task(crud._cached_read("slip:b", load, lambda value: False))
+        await asyncio.sleep(0)
+        await crud._invalidate_slip_cache(["a"], ["res-1"])
+        release.set()
+        await pending
+        assert await crud.slip_cache.get("slip:b") == (True, {"id": "b"})
+
+    _run(scenario)